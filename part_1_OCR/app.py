@@ -1,11 +1,12 @@
 import os
 import json
-import base64
-from typing import Dict, Any
+import asyncio
+from typing import Dict, Any, List
+from openai import AsyncAzureOpenAI
 import streamlit as st
 import pandas as pd
 from dotenv import load_dotenv
-from utilss import DocumentProcessor, FieldExtractor, FormValidator, FORM_SCHEMA_ENGLISH, FORM_SCHEMA_HEBREW
+from utilss import DocumentProcessor, FieldExtractor, FormValidator, ResultCache, FORM_SCHEMA_ENGLISH, FORM_SCHEMA_HEBREW
 
 load_dotenv()
 
@@ -15,7 +16,7 @@ document_key = os.environ.get("AZURE_DOCUMENT_INTELLIGENCE_KEY")
 openai_endpoint = os.environ.get("AZURE_OPENAI_ENDPOINT")
 openai_key = os.environ.get("AZURE_OPENAI_KEY_1")
 deployment_name = os.environ.get("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4o")
-api_version = os.environ.get("AZURE_OPENAI_API_VERSION", "2023-05-15")
+api_version = os.environ.get("AZURE_OPENAI_API_VERSION", "2024-10-01-preview")
 
 required_vars = {
     "Document Intelligence Endpoint": document_endpoint,
@@ -26,16 +27,21 @@ required_vars = {
 
 missing_vars = [name for name, value in required_vars.items() if not value]
 
-if not missing_vars:
-    try:
-        document_processor = DocumentProcessor(document_endpoint, document_key)
-        field_extractor = FieldExtractor(openai_endpoint, openai_key, deployment_name, api_version)
-        st.session_state.setup_success = True
-    except Exception as e:
-        st.error(f"Error initializing services: {str(e)}")
-        st.session_state.setup_success = False
-else:
-    st.session_state.setup_success = False
+max_concurrent_documents = 8
+
+cache_dir = os.environ.get("RESULT_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
+
+@st.cache_resource
+def get_result_cache(directory: str) -> ResultCache:
+    return ResultCache(directory)
+
+@st.cache_resource
+def get_document_processor(endpoint: str, key: str) -> DocumentProcessor:
+    return DocumentProcessor(endpoint, key, cache=get_result_cache(cache_dir))
+
+@st.cache_resource
+def get_field_extractor(endpoint: str, key: str, deployment: str, version: str) -> FieldExtractor:
+    return FieldExtractor(endpoint, key, deployment, version, cache=get_result_cache(cache_dir))
 
 st.set_page_config(
     page_title="Form Field Extractor",
@@ -71,32 +77,33 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-def display_json(json_data: Dict[str, Any], validation_messages: Dict[str, str] = None):
-    validation_messages = validation_messages or {}
+@st.cache_data
+def _flatten_to_df(json_data: Dict[str, Any], validation_messages: Dict[str, str]) -> pd.DataFrame:
+    rows = []
+    # iterative depth-first walk; keeping the item iterators on the stack
+    # preserves the field order of the original dict
+    stack = [("", iter(json_data.items()))]
     
-    def build_rows(data, prefix="", rows=None):
-        if rows is None:
-            rows = []
+    while stack:
+        prefix, items = stack[-1]
+        item = next(items, None)
+        if item is None:
+            stack.pop()
+            continue
         
-        for key, value in data.items():
-            full_key = f"{prefix}.{key}" if prefix else key
-            
-            if isinstance(value, dict):
-                build_rows(value, full_key, rows)
-            else:
-                message = validation_messages.get(full_key, "")
-                
-                rows.append({
-                    "Field": full_key,
-                    "Value": str(value),
-                    "Validation": message
-                })
+        key, value = item
+        full_key = f"{prefix}.{key}" if prefix else key
         
-        return rows
+        if isinstance(value, dict):
+            stack.append((full_key, iter(value.items())))
+        else:
+            rows.append((full_key, str(value), validation_messages.get(full_key, "")))
     
-    df_data = build_rows(json_data)
-    if df_data:
-        df = pd.DataFrame(df_data)
+    return pd.DataFrame.from_records(rows, columns=("Field", "Value", "Validation"))
+
+def display_json(json_data: Dict[str, Any], validation_messages: Dict[str, str] = None):
+    df = _flatten_to_df(json_data, validation_messages or {})
+    if not df.empty:
         st.dataframe(df, use_container_width=True)
     else:
         st.info("No data to display")
@@ -111,11 +118,86 @@ def display_confidence(confidence: float):
     
     st.markdown(f'<p>Extraction Confidence: <span class="{confidence_class}">{confidence:.2f}</span></p>', unsafe_allow_html=True)
 
-def get_download_link(json_data: Dict[str, Any], filename: str):
-    json_str = json.dumps(json_data, indent=2, ensure_ascii=False)
-    b64 = base64.b64encode(json_str.encode("utf-8")).decode()
-    href = f'<a href="data:application/json;charset=utf-8;base64,{b64}" download="{filename}">Download JSON</a>'
-    return href
+@st.cache_data
+def serialize_json(json_data: Dict[str, Any]) -> bytes:
+    return json.dumps(json_data, indent=2, ensure_ascii=False).encode("utf-8")
+
+async def process_file(document_processor: DocumentProcessor, field_extractor: FieldExtractor, client: AsyncAzureOpenAI, file_content: bytes, on_progress=None, use_cache: bool = True):
+    ocr_result = await document_processor.process_document(file_content, use_cache=use_cache)
+    extracted_fields = await field_extractor.extract_fields(ocr_result, client, on_progress=on_progress, use_cache=use_cache)
+    return ocr_result, extracted_fields
+
+async def process_files(document_processor: DocumentProcessor, field_extractor: FieldExtractor, files: List[bytes], on_done=None, on_progress=None, use_cache: bool = True):
+    # bounded fan-out so a large batch doesn't trip the Azure rate limits;
+    # a failed document is returned as its exception instead of failing the batch
+    semaphore = asyncio.Semaphore(max_concurrent_documents)
+    
+    # the client lives exactly as long as this run's event loop; asyncio.run closes the loop afterwards
+    async with field_extractor.create_client() as client:
+        async def process_one(index: int, file_content: bytes):
+            async with semaphore:
+                try:
+                    # on_progress gets the document's index along with the characters received so far
+                    file_progress = (lambda received: on_progress(index, received)) if on_progress else None
+                    return index, await process_file(document_processor, field_extractor, client, file_content, on_progress=file_progress, use_cache=use_cache)
+                except Exception as e:
+                    return index, e
+        
+        results = [None] * len(files)
+        tasks = [process_one(index, file_content) for index, file_content in enumerate(files)]
+        for done, task in enumerate(asyncio.as_completed(tasks), start=1):
+            index, result = await task
+            results[index] = result
+            if on_done:
+                on_done(done, len(files))
+        return results
+
+def display_result(result: Dict[str, Any], index: int):
+    if "error" in result:
+        st.error(f"Error processing document {result['name']}: {result['error']}")
+        return
+    
+    validated_fields = result["validated_fields"]
+    validation_messages = result["validation_messages"]
+    ocr_result = result["ocr_result"]
+    
+    st.subheader("Extracted Fields")
+    
+    confidence = float(validation_messages.get("_overall_confidence", "0"))
+    display_confidence(confidence)
+    
+    filled_fields = validation_messages.get("_filled_fields", "0/0")
+    st.write(f"Fields filled: {filled_fields}")
+    
+    st.json(validated_fields)
+    
+    st.download_button(
+        "Download JSON",
+        data=serialize_json(validated_fields),
+        file_name=f"{os.path.splitext(result['name'])[0]}_extracted_fields.json",
+        mime="application/json",
+        key=f"download_{index}"
+    )
+    
+    with st.expander("Validation Messages"):
+        display_messages = {k: v for k, v in validation_messages.items() 
+                           if not k.startswith("_")}
+        
+        if display_messages:
+            for field, message in display_messages.items():
+                st.markdown(f"**{field}**: {message}")
+        else:
+            st.write("No validation issues found.")
+    
+    with st.expander("Raw OCR Result"):
+        st.write("Document Content:")
+        st.text(ocr_result.get("content", "No content available"))
+        
+        st.write("Detected Language:", 
+                 "Hebrew" if ocr_result.get("language") == "he" else "English")
+        
+        st.write(f"Pages: {len(ocr_result.get('pages', []))}")
+        st.write(f"Tables: {len(ocr_result.get('tables', []))}")
 
 def main():
     st.title("National Insurance Form Field Extractor")
@@ -125,92 +207,99 @@ def main():
         st.info("Please set these variables in the .env file and restart the application.")
         return
     
+    try:
+        document_processor = get_document_processor(document_endpoint, document_key)
+        field_extractor = get_field_extractor(openai_endpoint, openai_key, deployment_name, api_version)
+    except Exception as e:
+        st.error(f"Error initializing services: {str(e)}")
+        return
+    
+    use_cache = not st.sidebar.checkbox("Don't use cached results", value=False,
+                                        help="Re-run OCR and extraction even if this file was processed before")
+    
     tab1, tab2, tab3 = st.tabs(["Extract Fields", "View Sample", "Help"])
     
     with tab1:
         st.header("Upload and Extract Form Fields")
-        st.write("Upload a PDF or image file of a National Insurance Institute form to extract its fields.")
+        st.write("Upload one or more PDF or image files of National Insurance Institute forms to extract their fields.")
         
-        uploaded_file = st.file_uploader(
-            "Choose a file", 
+        uploaded_files = st.file_uploader(
+            "Choose files", 
             type=["pdf", "jpg", "jpeg", "png"], 
-            accept_multiple_files=False
+            accept_multiple_files=True
             )
         
-        if uploaded_file is not None:
-            file_details = {
-                "Filename": uploaded_file.name,
-                "File size": f"{uploaded_file.size / 1024:.2f} KB",
-                "File type": uploaded_file.type
-            }
-            st.write("File Details:", file_details)
-            
-            if uploaded_file.type.startswith("image"):
-                st.image(uploaded_file, caption="Uploaded Image", use_column_width=True)
-            elif uploaded_file.type == "application/pdf":
-                st.write("PDF file uploaded. Processing...")
+        if uploaded_files:
+            # a new upload invalidates the results of the previous one
+            upload_ids = tuple(uploaded_file.file_id for uploaded_file in uploaded_files)
+            if st.session_state.get("upload_ids") != upload_ids:
+                st.session_state.pop("results", None)
+                st.session_state.upload_ids = upload_ids
             
-            if "extracted_fields" not in st.session_state and st.button("Extract Fields"):
-                with st.spinner("Processing the document..."):
-                    try:
-                        file_extension = uploaded_file.name.split(".")[-1].lower()
-
-                        ocr_result = document_processor.process_document(
-                            uploaded_file.getvalue(), 
-                            file_extension
-                        )
-
-                        extracted_fields = field_extractor.extract_fields(ocr_result)
-
-                        validator = FormValidator()
-                        validated_fields, validation_messages = validator.validate_fields(extracted_fields)
-
-                        st.session_state.extracted_fields = extracted_fields
-                        st.session_state.validated_fields = validated_fields
-                        st.session_state.validation_messages = validation_messages
-                        st.session_state.ocr_result = ocr_result
-
-                        st.success("Document processed successfully!")
-
-                    except Exception as e:
-                        st.error(f"Error processing document: {str(e)}")
-                        return
+            for uploaded_file in uploaded_files:
+                with st.expander(uploaded_file.name, expanded=len(uploaded_files) == 1):
+                    file_details = {
+                        "Filename": uploaded_file.name,
+                        "File size": f"{uploaded_file.size / 1024:.2f} KB",
+                        "File type": uploaded_file.type
+                    }
+                    st.write("File Details:", file_details)
+                    
+                    if uploaded_file.type.startswith("image"):
+                        st.image(uploaded_file, caption="Uploaded Image", use_column_width=True)
+                    elif uploaded_file.type == "application/pdf":
+                        st.write("PDF file uploaded.")
             
-            if hasattr(st.session_state, 'validated_fields'):
-                st.subheader("Extracted Fields")
-                
-                confidence = float(st.session_state.validation_messages.get("_overall_confidence", "0"))
-                display_confidence(confidence)
-                
-                filled_fields = st.session_state.validation_messages.get("_filled_fields", "0/0")
-                st.write(f"Fields filled: {filled_fields}")
+            if "results" not in st.session_state and st.button("Extract Fields"):
+                with st.spinner("Processing the documents..."):
+                    progress = st.progress(0.0)
+                    # a live caption per document while its extraction streams in
+                    file_captions = [st.empty() for _ in uploaded_files]
+                    outcomes = asyncio.run(process_files(
+                        document_processor,
+                        field_extractor,
+                        [uploaded_file.getvalue() for uploaded_file in uploaded_files],
+                        on_done=lambda done, total: progress.progress(done / total, text=f"Processed {done}/{total} documents"),
+                        on_progress=lambda index, received: file_captions[index].caption(
+                            f"{uploaded_files[index].name}: receiving extraction... {received} characters"
+                        ),
+                        use_cache=use_cache
+                    ))
+                    progress.empty()
+                    for caption in file_captions:
+                        caption.empty()
                 
-                st.json(st.session_state.validated_fields)
-                
-                st.markdown(
-                    get_download_link(st.session_state.validated_fields, "extracted_fields.json"),
-                    unsafe_allow_html=True
-                )
-                
-                with st.expander("Validation Messages"):
-                    display_messages = {k: v for k, v in st.session_state.validation_messages.items() 
-                                       if not k.startswith("_")}
+                validator = FormValidator()
+                results = []
+                for uploaded_file, outcome in zip(uploaded_files, outcomes):
+                    if isinstance(outcome, Exception):
+                        results.append({"name": uploaded_file.name, "error": str(outcome)})
+                        continue
                     
-                    if display_messages:
-                        for field, message in display_messages.items():
-                            st.markdown(f"**{field}**: {message}")
-                    else:
-                        st.write("No validation issues found.")
+                    ocr_result, extracted_fields = outcome
+                    validated_fields, validation_messages = validator.validate_fields(extracted_fields)
+                    results.append({
+                        "name": uploaded_file.name,
+                        "extracted_fields": extracted_fields,
+                        "validated_fields": validated_fields,
+                        "validation_messages": validation_messages,
+                        "ocr_result": ocr_result
+                    })
                 
-                with st.expander("Raw OCR Result"):
-                    st.write("Document Content:")
-                    st.text(st.session_state.ocr_result.get("content", "No content available"))
-                    
-                    st.write("Detected Language:", 
-                             "Hebrew" if st.session_state.ocr_result.get("language") == "he" else "English")
-                    
-                    st.write(f"Pages: {len(st.session_state.ocr_result.get('pages', []))}")
-                    st.write(f"Tables: {len(st.session_state.ocr_result.get('tables', []))}")
+                st.session_state.results = results
+                
+                failed = sum(1 for result in results if "error" in result)
+                if failed < len(results):
+                    st.success(f"Processed {len(results) - failed} of {len(results)} documents successfully!")
+            
+            if "results" in st.session_state:
+                results = st.session_state.results
+                if len(results) == 1:
+                    display_result(results[0], 0)
+                else:
+                    for index, (result_tab, result) in enumerate(zip(st.tabs([result["name"] for result in results]), results)):
+                        with result_tab:
+                            display_result(result, index)
     
     with tab2:
         st.header("Sample Form Structure")
@@ -237,7 +326,7 @@ def main():
         
         ### How to Use
         
-        1. **Upload** a PDF or image file of a filled National Insurance form
+        1. **Upload** one or more PDF or image files of filled National Insurance forms
         2. Click **Extract Fields** to process the document
         3. View the extracted fields in JSON format
         4. Download the JSON result if needed
@@ -1,4 +1,5 @@
 # Import utility classes for easier access
 from .document_processor import DocumentProcessor
 from .field_extractor import FieldExtractor, FORM_SCHEMA_ENGLISH, FORM_SCHEMA_HEBREW
-from .validators import FormValidator
\ No newline at end of file
+from .validators import FormValidator
+from .result_cache import ResultCache
\ No newline at end of file
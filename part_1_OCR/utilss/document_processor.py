@@ -1,72 +1,114 @@
-import os
-import tempfile
-from typing import Dict, Any
+import io
+import asyncio
+import string
+import threading
+from functools import lru_cache
+from typing import Dict, Any, Optional, Tuple
+import requests
 from azure.core.credentials import AzureKeyCredential
+from azure.core.pipeline.transport import RequestsTransport
 from azure.ai.documentintelligence import DocumentIntelligenceClient
 
+from .result_cache import ResultCache, content_key
+
+# deletion tables: the number of characters a translate() removes is the
+# number of characters of that script in the text
+HEBREW_TABLE = dict.fromkeys(range(0x0590, 0x0600))
+ENGLISH_TABLE = dict.fromkeys(map(ord, string.ascii_letters))
+
+@lru_cache(maxsize=32)
+def _count_script_chars(text: str) -> tuple:
+    length = len(text)
+    return length - len(text.translate(HEBREW_TABLE)), length - len(text.translate(ENGLISH_TABLE))
+
+# requests.Session is not thread-safe and the analyze calls run concurrently in
+# to_thread workers, so each worker thread keeps its own clients and keep-alive
+# session; the executor reuses its threads, so the connections are still reused
+_LOCAL = threading.local()
+
+def _get_client(endpoint: str, key: str) -> DocumentIntelligenceClient:
+    clients: Dict[Tuple[str, str], DocumentIntelligenceClient] = getattr(_LOCAL, "clients", None)
+    if clients is None:
+        clients = _LOCAL.clients = {}
+    client = clients.get((endpoint, key))
+    if client is None:
+        client = DocumentIntelligenceClient(
+            endpoint=endpoint,
+            credential=AzureKeyCredential(key),
+            transport=RequestsTransport(session=requests.Session(), session_owner=True)
+        )
+        clients[(endpoint, key)] = client
+    return client
+
 class DocumentProcessor:
     
-    def __init__(self, endpoint: str, key: str):
+    def __init__(self, endpoint: str, key: str, cache: Optional[ResultCache] = None):
         self.endpoint = endpoint
-        self.credential = AzureKeyCredential(key)
-        self.client = DocumentIntelligenceClient(endpoint=self.endpoint, credential=self.credential)
+        self.cache = cache
+        self.key = key
     
-    def process_document(self, file_content: bytes, file_extension: str) -> Dict[str, Any]:
+    @property
+    def client(self) -> DocumentIntelligenceClient:
+        # looked up per call: _analyze runs on whichever worker thread is free
+        return _get_client(self.endpoint, self.key)
+    
+    def _analyze(self, file_content: bytes):
+        poller = self.client.begin_analyze_document(
+            model_id="prebuilt-layout",
+            body=io.BytesIO(file_content),
+            content_type="application/octet-stream"
+        )
+        return poller.result()
+    
+    async def process_document(self, file_content: bytes, use_cache: bool = True) -> Dict[str, Any]:
         try:
-            with tempfile.NamedTemporaryFile(suffix=f'.{file_extension}', delete=False) as temp_file:
-                temp_file.write(file_content)
-                temp_file_path = temp_file.name
-            
-            with open(temp_file_path, "rb") as file:
-                poller = self.client.begin_analyze_document(
-                    model_id="prebuilt-layout",
-                    body=file
-                )
-                result = poller.result()
+            cache_key = content_key("ocr", file_content)
+            if use_cache and self.cache is not None:
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    return cached
             
-            os.unlink(temp_file_path)
+            # the SDK call and its polling are blocking, keep them off the event loop
+            result = await asyncio.to_thread(self._analyze, file_content)
             
             ocr_result = {
                 "content": result.content,
-                "pages": [],
-                "tables": [],
+                "pages": [
+                    {
+                        "page_number": page.page_number,
+                        "width": page.width,
+                        "height": page.height,
+                        "unit": page.unit,
+                        "lines": [{"content": line.content, "bounding_box": line.polygon} for line in page.lines],
+                        "words": [{"content": word.content, "confidence": word.confidence} for word in page.words]
+                    } for page in result.pages
+                ],
+                "tables": [
+                    {
+                        "row_count": table.row_count,
+                        "column_count": table.column_count,
+                        "cells": [
+                            {
+                                "row_index": cell.row_index,
+                                "column_index": cell.column_index,
+                                "content": cell.content,
+                                "bounding_box": cell.bounding_regions[0].polygon if cell.bounding_regions else None
+                            } for cell in table.cells
+                        ]
+                    } for table in result.tables or []
+                ],
                 "language": self._detect_language(result.content)
             }
             
-            for page in result.pages:
-                page_info = {
-                    "page_number": page.page_number,
-                    "width": page.width,
-                    "height": page.height,
-                    "unit": page.unit,
-                    "lines": [{"content": line.content, "bounding_box": line.polygon} for line in page.lines],
-                    "words": [{"content": word.content, "confidence": word.confidence} for word in page.words]
-                }
-                ocr_result["pages"].append(page_info)
-            
-            for table in result.tables:
-                table_info = {
-                    "row_count": table.row_count,
-                    "column_count": table.column_count,
-                    "cells": [
-                        {
-                            "row_index": cell.row_index,
-                            "column_index": cell.column_index,
-                            "content": cell.content,
-                            "bounding_box": cell.bounding_regions[0].polygon if cell.bounding_regions else None
-                        } for cell in table.cells
-                    ]
-                }
-                ocr_result["tables"].append(table_info)
-            
+            if self.cache is not None:
+                self.cache.set(cache_key, ocr_result)
             return ocr_result
             
         except Exception as e:
             raise
     
     def _detect_language(self, text: str) -> str:
-        hebrew_chars = sum(1 for char in text if '\u0590' <= char <= '\u05FF')
-        english_chars = sum(1 for char in text if 'a' <= char.lower() <= 'z')
+        hebrew_chars, english_chars = _count_script_chars(text)
         
         if hebrew_chars > english_chars * 0.5:
             return "he"
@@ -1,8 +1,19 @@
+import copy
 import json
 import logging
-from typing import Dict, Any, List
+from functools import lru_cache
+from typing import Dict, Any, List, Callable, Optional
 
-import openai
+import tiktoken
+from openai import AsyncAzureOpenAI
+
+from .result_cache import ResultCache, content_key
+
+logger = logging.getLogger(__name__)
+
+# token budgets for the OCR text sent to the model
+MAX_TEXT_TOKENS = 3000
+MAX_PAGE_TOKENS = 600
 
 FORM_SCHEMA_ENGLISH = {
     "lastName": "",
@@ -139,20 +150,115 @@ FIELD_TRANSLATION = {
     "אבחנות רפואיות": "medicalDiagnoses"
 }
 
+# per-parent sub-key translations, so nested dicts translate with a single lookup table
+_SUBKEY_MAPS = {
+    parent: {sub_key: FIELD_TRANSLATION.get(sub_key, sub_key) for sub_key in value}
+    for parent, value in FORM_SCHEMA_HEBREW.items() if isinstance(value, dict)
+}
+
+FIELD_DESCRIPTIONS = {
+    "lastName": "Family name of the injured person (שם משפחה), as written on the form.",
+    "firstName": "Given name of the injured person (שם פרטי), as written on the form.",
+    "idNumber": "Israeli ID number of the injured person (מספר זהות), usually 9 digits. Copy the digits only.",
+    "gender": "Gender of the injured person (מין), as marked on the form: male/female or זכר/נקבה.",
+    "dateOfBirth": "Date of birth of the injured person (תאריך לידה), split into day, month and year.",
+    "address": "Home address of the injured person (כתובת): street (רחוב), house number (מספר בית), entrance (כניסה), apartment (דירה), city (ישוב), postal code (מיקוד) and PO box (תא דואר).",
+    "landlinePhone": "Landline phone number (טלפון קווי), usually starting with 0 and a one-digit area code.",
+    "mobilePhone": "Mobile phone number (טלפון נייד), usually starting with 05.",
+    "jobType": "The kind of work the injured person does (סוג העבודה).",
+    "dateOfInjury": "Date on which the injury happened (תאריך הפגיעה), split into day, month and year.",
+    "timeOfInjury": "Time of day at which the injury happened (שעת הפגיעה), e.g. 14:30.",
+    "accidentLocation": "Where the accident happened (מקום התאונה), e.g. at work, on the way to work, on the way from work, traffic accident, other.",
+    "accidentAddress": "Street address of the place where the accident happened (כתובת מקום התאונה).",
+    "accidentDescription": "Free-text description of how the accident happened (תיאור התאונה / נסיבות הפגיעה).",
+    "injuredBodyPart": "The body part that was injured (האיבר שנפגע).",
+    "signature": "The name written in the signature box (חתימה), if it is legible.",
+    "formFillingDate": "Date on which the form was filled in (תאריך מילוי הטופס), split into day, month and year.",
+    "formReceiptDateAtClinic": "Date on which the form was received at the health fund clinic (תאריך קבלת הטופס בקופה), split into day, month and year.",
+    "medicalInstitutionFields": "The section filled in by the medical institution (למילוי ע\"י המוסד הרפואי): health fund membership (חבר בקופת חולים, e.g. כללית, מכבי, מאוחדת, לאומית), nature of the accident (מהות התאונה) and medical diagnoses (אבחנות רפואיות)."
+}
+
+EXTRACTION_RULES = [
+    "The OCR text may contain both the printed labels of the form and the handwritten or typed values; extract only the values.",
+    "Checkbox fields are marked in the OCR text with selection marks (e.g. :selected: / :unselected: or X); use the label next to the selected mark as the value.",
+    "Dates may appear as a single string such as 03/05/2023, 3.5.23 or 03052023; always split them into day, month and year.",
+    "Keep the year exactly as it appears on the form, do not guess missing digits.",
+    "Phone numbers and ID numbers must contain digits only, without dashes or spaces.",
+    "Do not translate values: a value written in Hebrew stays in Hebrew and a value written in English stays in English.",
+    "If the same field appears more than once, prefer the value from the section that matches the field label most closely.",
+    "Never invent values that do not appear in the text."
+]
+
+def _build_prefix(language: str, schema: Dict[str, Any]) -> str:
+    # everything in here is identical for every document of the same language,
+    # so it is built once and kept first in the conversation where Azure OpenAI can cache it
+    if language == "he":
+        instruction = """
+        אתה מומחה בחילוץ מידע מטפסי ביטוח לאומי. יש לחלץ את כל השדות מהטקסט המצורף ולמלא אותם בפורמט JSON המסופק.
+        עבור שדות שלא ניתן למצוא בטקסט, השאר מחרוזת ריקה.
+        בדוק היטב תאריכים ומספרים, והפרד אותם לפי הדרישה (יום/חודש/שנה).
+        תן את התוצאה כ-JSON בלבד, ללא הסברים נוספים.
+        """
+    else:
+        instruction = """
+        You are an expert in extracting information from National Insurance Institute forms in Israel. 
+        Extract all fields from the provided text and fill them into the provided JSON format.
+        For fields that cannot be found in the text, leave an empty string.
+        Pay careful attention to dates and numbers, separating them as required (day/month/year).
+        Return ONLY the JSON result, with no additional explanations.
+        """
+    
+    descriptions = "\n".join(f"- {field}: {description}" for field, description in FIELD_DESCRIPTIONS.items())
+    rules = "\n".join(f"- {rule}" for rule in EXTRACTION_RULES)
+    
+    return "\n".join([
+        instruction,
+        "Extraction Rules:", rules, "",
+        "Field Descriptions:", descriptions, "",
+        "JSON Schema to Fill (provide only the filled JSON as response):",
+        json.dumps(schema, indent=2, ensure_ascii=False)
+    ])
+
+_PROMPT_PREFIX_EN = _build_prefix("en", FORM_SCHEMA_ENGLISH)
+_PROMPT_PREFIX_HE = _build_prefix("he", FORM_SCHEMA_HEBREW)
+
+_JSON_DECODER = json.JSONDecoder()
+
+@lru_cache(maxsize=None)
+def _get_encoding() -> tiktoken.Encoding:
+    return tiktoken.encoding_for_model("gpt-4o")
+
+def trim_to_tokens(text: str, n_tokens: int) -> str:
+    # a byte-level BPE token covers at least one UTF-8 byte (a Hebrew letter is two),
+    # so texts with no more bytes than the budget never need encoding
+    if len(text.encode("utf-8")) <= n_tokens:
+        return text
+    tokens = _get_encoding().encode(text)
+    if len(tokens) <= n_tokens:
+        return text
+    # the cut can fall inside a multi-byte character; drop that partial character
+    # rather than letting decode() turn it into U+FFFD
+    return _get_encoding().decode_bytes(tokens[:n_tokens]).decode("utf-8", errors="ignore")
+
 class FieldExtractor:    
-    def __init__(self, endpoint: str, key: str, deployment_name: str, api_version: str):
+    def __init__(self, endpoint: str, key: str, deployment_name: str, api_version: str, cache: Optional[ResultCache] = None):
         self.endpoint = endpoint
+        self.cache = cache
         self.key = key
         self.deployment_name = deployment_name
         self.api_version = api_version
-        
-        openai.api_type = "azure"
-        openai.api_key = key
-        openai.api_base = endpoint
-        openai.api_version = api_version
-        
     
-    def extract_fields(self, ocr_result: Dict[str, Any]) -> Dict[str, Any]:
+    def create_client(self) -> AsyncAzureOpenAI:
+        # an async client's connection pool is bound to the event loop it runs on, and every
+        # Streamlit run drives its own loop, so only this configuration is kept and each run
+        # opens (and closes) a client of its own with `async with extractor.create_client()`
+        return AsyncAzureOpenAI(
+            azure_endpoint=self.endpoint,
+            api_key=self.key,
+            api_version=self.api_version
+        )
+    
+    async def extract_fields(self, ocr_result: Dict[str, Any], client: AsyncAzureOpenAI, on_progress: Optional[Callable[[int], None]] = None, use_cache: bool = True) -> Dict[str, Any]:
         try:
             language = ocr_result.get("language", "en") # default value is english
             
@@ -160,74 +266,117 @@ class FieldExtractor:
             
             all_text = ocr_result["content"]
             
+            cache_key = content_key("extraction", all_text, language, self.deployment_name)
+            if use_cache and self.cache is not None:
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    return cached
+            
             
-            page_content = []
-            for page in ocr_result["pages"]:
-                page_text = f"Page {page['page_number']}:\n"
-                for line in page["lines"]:
-                    page_text += f"{line['content']}\n"
-                page_content.append(page_text)
+            page_content = [
+                "\n".join([f"Page {page['page_number']}:", *(line["content"] for line in page["lines"])])
+                for page in ocr_result["pages"]
+            ]
             
-            prompt = self._create_extraction_prompt(all_text, page_content, language, schema)
+            system_prompt = _PROMPT_PREFIX_HE if language == "he" else _PROMPT_PREFIX_EN
+            prompt = self._create_extraction_prompt(all_text, page_content)
             
-            response = openai.ChatCompletion.create(
-                engine=self.deployment_name,
+            stream = await client.chat.completions.create(
+                model=self.deployment_name,
                 messages=[
-                    {"role": "system", "content": "You are an expert in extracting information from document forms, particularly National Insurance Institute forms in Israel."},
+                    {"role": "system", "content": system_prompt},
                     {"role": "user", "content": prompt}
                 ],
                 temperature=0.1, # better as 0.1 for low randomness 
-                max_tokens=4000
+                max_tokens=4000,
+                stream=True,
+                stream_options={"include_usage": True}
             )
             
-            extracted_json = self._process_openai_response(response)
+            content = await self._collect_stream(stream, on_progress)
+            
+            extracted_json = self._process_openai_response(content)
+            
+            # a fallback schema means the response could not be parsed, don't keep it
+            if extracted_json is FORM_SCHEMA_ENGLISH:
+                return extracted_json
             
             if language == "he":
                 extracted_json = self._translate_schema_hebrew_to_english(extracted_json)
+            
+            if self.cache is not None:
+                self.cache.set(cache_key, extracted_json)
             return extracted_json
             
         except Exception as e:
             print(f"Error extracting fields: {str(e)}")
             return schema  # Return empty schema if extraction fails
     
-    def _create_extraction_prompt(self, all_text: str, page_content: List[str], language: str, schema: Dict[str, Any]) -> str:
-        if language == "he":
-            instruction = """
-            אתה מומחה בחילוץ מידע מטפסי ביטוח לאומי. יש לחלץ את כל השדות מהטקסט המצורף ולמלא אותם בפורמט JSON המסופק.
-            עבור שדות שלא ניתן למצוא בטקסט, השאר מחרוזת ריקה.
-            בדוק היטב תאריכים ומספרים, והפרד אותם לפי הדרישה (יום/חודש/שנה).
-            תן את התוצאה כ-JSON בלבד, ללא הסברים נוספים.
-            """
-        else:
-            instruction = """
-            You are an expert in extracting information from National Insurance Institute forms in Israel. 
-            Extract all fields from the provided text and fill them into the provided JSON format.
-            For fields that cannot be found in the text, leave an empty string.
-            Pay careful attention to dates and numbers, separating them as required (day/month/year).
-            Return ONLY the JSON result, with no additional explanations.
-            """
+    async def _collect_stream(self, stream, on_progress: Optional[Callable[[int], None]] = None) -> str:
+        # tracks brace depth outside of JSON strings so we know when the
+        # top-level object is closed; anything after it is not collected
+        buffer = []
+        depth = 0
+        started = in_string = escaped = complete = False
+        received = 0
         
-        prompt = f"{instruction}\n\n"
-        prompt += f"Form Text:\n{all_text[:4000]}\n\n"
-        
-        prompt += "Page-by-Page Content:\n"
-        for page_text in page_content:
-            prompt += f"{page_text[:1000]}\n"
+        async for chunk in stream:
+            if chunk.usage:
+                # the usage chunk is the last one and carries no choices
+                details = getattr(chunk.usage, "prompt_tokens_details", None)
+                cached = getattr(details, "cached_tokens", 0) or 0
+                logger.debug("Extraction prompt tokens: %d (cached: %d)", chunk.usage.prompt_tokens, cached)
+            if complete or not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            
+            buffer.append(delta)
+            received += len(delta)
+            if on_progress:
+                on_progress(received)
+            
+            for char in delta:
+                if in_string:
+                    if escaped:
+                        escaped = False
+                    elif char == "\\":
+                        escaped = True
+                    elif char == '"':
+                        in_string = False
+                elif char == '"':
+                    in_string = started
+                elif char == "{":
+                    depth += 1
+                    started = True
+                elif char == "}" and started:
+                    depth -= 1
+            
+            if started and depth == 0:
+                content = "".join(buffer)
+                try:
+                    _JSON_DECODER.raw_decode(content, content.find("{"))
+                    complete = True
+                except json.JSONDecodeError:
+                    continue
         
-        prompt += f"\nJSON Schema to Fill (provide only the filled JSON as response):\n{json.dumps(schema, indent=2, ensure_ascii=False)}"
-
-        return prompt
+        return "".join(buffer)
+    
+    def _create_extraction_prompt(self, all_text: str, page_content: List[str]) -> str:
+        return "\n".join([
+            "Form Text:", trim_to_tokens(all_text, MAX_TEXT_TOKENS), "",
+            "Page-by-Page Content:",
+            "\n\n".join(trim_to_tokens(page_text, MAX_PAGE_TOKENS) for page_text in page_content)
+        ])
     
-    def _process_openai_response(self, response: Dict[str, Any]) -> Dict[str, Any]:
+    def _process_openai_response(self, content: str) -> Dict[str, Any]:
         try:
-            content = response["choices"][0]["message"]["content"]
-            
             json_start = content.find("{")
-            json_end = content.rfind("}") + 1
             
-            if json_start >= 0 and json_end > json_start:
-                json_str = content[json_start:json_end]
-                extracted_json = json.loads(json_str)
+            if json_start >= 0:
+                # parses exactly one object and ignores any chatter after it
+                extracted_json, _ = _JSON_DECODER.raw_decode(content, json_start)
                 return extracted_json
             else:
                 print("No valid JSON found in OpenAI response")
@@ -238,24 +387,18 @@ class FieldExtractor:
             return FORM_SCHEMA_ENGLISH 
     
     def _translate_schema_hebrew_to_english(self, hebrew_schema: Dict[str, Any]) -> Dict[str, Any]:
-        english_schema = {}
-        
         try:
+            # start from the full English schema so missing fields are already in place
+            english_schema = copy.deepcopy(FORM_SCHEMA_ENGLISH)
+            
             for key, value in hebrew_schema.items():
                 english_key = FIELD_TRANSLATION.get(key, key)
                 
                 if isinstance(value, dict):
-                    english_value = {}
-                    for sub_key, sub_value in value.items():
-                        english_sub_key = FIELD_TRANSLATION.get(sub_key, sub_key)
-                        english_value[english_sub_key] = sub_value
-                    english_schema[english_key] = english_value
+                    sub_map = _SUBKEY_MAPS.get(key, FIELD_TRANSLATION)
+                    english_schema[english_key] = {sub_map.get(sub_key, sub_key): sub_value for sub_key, sub_value in value.items()}
                 else:
                     english_schema[english_key] = value
-            
-            for key, value in FORM_SCHEMA_ENGLISH.items():
-                if key not in english_schema:
-                    english_schema[key] = value
                     
             return english_schema
                 
@@ -0,0 +1,47 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+import diskcache
+
+def content_key(*parts) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+class ResultCache:
+    # small in-process LRU in front of an on-disk cache, so repeated uploads
+    # of the same form skip the Azure round trips even after a restart
+
+    def __init__(self, directory: str, memory_size: int = 32):
+        self.memory_size = memory_size
+        self._memory = OrderedDict()
+        # shared by every Streamlit session through st.cache_resource, and each session runs
+        # on its own thread; the LRU reorders itself on reads too, so every access is locked
+        self._lock = threading.Lock()
+        self._disk = diskcache.Cache(directory)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+        value = self._disk.get(key)
+        if value is not None:
+            self._remember(key, value)
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        self._disk.set(key, value)
+        self._remember(key, value)
+
+    def _remember(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            if len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
@@ -1,28 +1,54 @@
 import re
+import copy
 from datetime import datetime
 from typing import Dict, Any, Tuple
 
+_NON_DIGIT = re.compile(r'\D')
+_PHONE_CLEAN = re.compile(r'[^\d+]')
+_TIME_RE = re.compile(r'(\d{1,2})[:.h](\d{2})')
+
+_DATE_UNITS = (("day", 1, 31), ("month", 1, 12))
+
+_GENDER_MAP = {
+    "m": "Male", "male": "Male", "זכר": "Male", "ז": "Male",
+    "f": "Female", "female": "Female", "נקבה": "Female", "נ": "Female"
+}
+
 class FormValidator:
     def validate_fields(self, data: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, str]]:
-        validated = data.copy()
+        validated = data
+        dirty = False
         messages = {}
         current_year = datetime.now().year
 
+        def _cow():
+            # deep copy on the first real change only; nested dicts must not be
+            # shared with the caller and clean documents need no copy at all
+            nonlocal validated, dirty
+            if not dirty:
+                validated = copy.deepcopy(data)
+                dirty = True
+
+        def _set(key: str, value: Any) -> None:
+            if validated.get(key) != value:
+                _cow()
+                validated[key] = value
+
         id_number = data.get("idNumber", "")
         if id_number:
-            clean = re.sub(r'\D', '', id_number)
+            clean = _NON_DIGIT.sub('', id_number)
             if len(clean) != 9:
                 messages["idNumber"] = f"ID must be 9 digits, got {len(clean)}"
             else:
-                validated["idNumber"] = clean
+                _set("idNumber", clean)
 
         for field in ["landlinePhone", "mobilePhone"]:
             phone = data.get(field, "")
             if phone:
-                clean = re.sub(r'[^\d+]', '', phone)
+                clean = _PHONE_CLEAN.sub('', phone)
                 if not 9 <= len(clean) <= 15:
                     messages[field] = f"Phone length is unusual: {len(clean)}"
-                validated[field] = clean
+                _set(field, clean)
 
         for field in ["dateOfBirth", "dateOfInjury", "formFillingDate", "formReceiptDateAtClinic"]:
             date = data.get(field, {})
@@ -30,50 +56,26 @@ class FormValidator:
                 messages[field] = "Expected a date dictionary"
                 continue
 
-            day, month, year = date.get("day", ""), date.get("month", ""), date.get("year", "")
-
-            for unit, min_val, max_val in [("day", 1, 31), ("month", 1, 12)]:
-                val = date.get(unit, "")
-                if val:
-                    try:
-                        n = int(val)
-                        if not min_val <= n <= max_val:
-                            messages[f"{field}.{unit}"] = f"{unit.capitalize()} out of range: {val}"
-                        validated[field][unit] = f"{n:02d}"
-                    except:
-                        messages[f"{field}.{unit}"] = f"Invalid {unit}: {val}"
-
-            if year:
-                try:
-                    y = int(year)
-                    if y < 100:
-                        y += 2000 if y <= 30 else 1900
-                    if field == "dateOfBirth":
-                        if not (1900 <= y <= current_year):
-                            messages[f"{field}.year"] = f"Unrealistic birth year: {y}"
-                    else:
-                        if not (2000 <= y <= current_year):
-                            messages[f"{field}.year"] = f"Year not in valid range: {y}"
-                    validated[field]["year"] = str(y)
-                except:
-                    messages[f"{field}.year"] = f"Invalid year: {year}"
+            updates = self._validate_date(date, field, messages, current_year)
+            if any(date.get(unit) != value for unit, value in updates.items()):
+                _cow()
+                validated[field].update(updates)
 
         gender = data.get("gender", "").lower()
         if gender:
-            if gender in ["m", "male", "זכר", "ז"]:
-                validated["gender"] = "Male"
-            elif gender in ["f", "female", "נקבה", "נ"]:
-                validated["gender"] = "Female"
+            normalized_gender = _GENDER_MAP.get(gender)
+            if normalized_gender:
+                _set("gender", normalized_gender)
             else:
                 messages["gender"] = f"Unknown gender: {gender}"
 
         time = data.get("timeOfInjury", "")
         if time:
-            match = re.search(r'(\d{1,2})[:.h](\d{2})', time)
+            match = _TIME_RE.search(time)
             if match:
                 h, m = map(int, match.groups())
                 if 0 <= h <= 23 and 0 <= m <= 59:
-                    validated["timeOfInjury"] = f"{h:02d}:{m:02d}"
+                    _set("timeOfInjury", f"{h:02d}:{m:02d}")
                 else:
                     messages["timeOfInjury"] = f"Time out of range: {h}:{m}"
             else:
@@ -84,18 +86,69 @@ class FormValidator:
             messages["address.postalCode"] = "Postal code is missing"
 
 
-        total = self._count_fields(data)
-        filled = self._count_filled_fields(data)
+        total, filled = self._count_fields(data)
         confidence = max(0, filled / total - min(0.5, len(messages) * 0.05)) if total > 0 else 0
 
         messages["_overall_confidence"] = f"{confidence:.2f}"
         messages["_filled_fields"] = f"{filled}/{total}"
 
         print(f"Validation complete — confidence: {confidence:.2f}, filled: {filled}/{total}")
-        return validated, messages
-
-    def _count_fields(self, data: Dict[str, Any]) -> int:
-        return sum(self._count_fields(v) if isinstance(v, dict) else 1 for v in data.values())
-
-    def _count_filled_fields(self, data: Dict[str, Any]) -> int:
-        return sum(self._count_filled_fields(v) if isinstance(v, dict) else bool(v) for v in data.values())
+        return (validated if dirty else data), messages
+
+    def _validate_date(self, d: Dict[str, Any], field: str, messages: Dict[str, str], current_year: int) -> Dict[str, str]:
+        # returns the normalized units; d itself is left untouched
+        parts = {}
+        updates = {}
+        for unit in ("day", "month", "year"):
+            val = d.get(unit)
+            if not val:
+                continue
+            val = str(val).strip()
+            if val.isdecimal():
+                parts[unit] = int(val)
+            else:
+                messages[f"{field}.{unit}"] = f"Invalid {unit}: {val}"
+
+        y = parts.get("year")
+        if y is not None:
+            if y < 100:
+                y += 2000 if y <= 30 else 1900
+            if field == "dateOfBirth":
+                if not (1900 <= y <= current_year):
+                    messages[f"{field}.year"] = f"Unrealistic birth year: {y}"
+            else:
+                if not (2000 <= y <= current_year):
+                    messages[f"{field}.year"] = f"Year not in valid range: {y}"
+            updates["year"] = str(y)
+
+        if "day" in parts or "month" in parts:
+            in_range = True
+            for unit, min_val, max_val in _DATE_UNITS:
+                if unit in parts and not min_val <= parts[unit] <= max_val:
+                    messages[f"{field}.{unit}"] = f"{unit.capitalize()} out of range: {d[unit]}"
+                    in_range = False
+            if in_range and "day" in parts and "month" in parts:
+                try:
+                    # the ranges above are per unit; this catches days the month doesn't have (30/02).
+                    # without a usable year a leap year is assumed so 29/02 passes
+                    datetime(y if y and y <= 9999 else 2000, parts["month"], parts["day"])
+                except ValueError:
+                    messages[f"{field}.day"] = f"Day out of range: {d['day']}"
+            for unit in ("day", "month"):
+                if unit in parts:
+                    updates[unit] = str(parts[unit]).zfill(2)
+
+        return updates
+
+    def _count_fields(self, data: Dict[str, Any]) -> Tuple[int, int]:
+        # returns (total, filled) for the subtree in a single walk
+        total = filled = 0
+        for value in data.values():
+            if isinstance(value, dict):
+                sub_total, sub_filled = self._count_fields(value)
+                total += sub_total
+                filled += sub_filled
+            else:
+                total += 1
+                filled += bool(value)
+        return total, filled
@@ -1,75 +1,134 @@
+import asyncio
+import logging
 import os
 import sys
 import glob
+import traceback
 from pathlib import Path
+from typing import List
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
+import httpx
 import uvicorn
-from contextlib import asynccontextmanager
+from contextlib import AsyncExitStack, asynccontextmanager
 
-from backend.config import settings, RAW_COMBINED_HTML_PATH, KNOWLEDGE_BASE_DIR
+from backend.config import settings, RAW_COMBINED_HTML_PATH, RAW_HTML_DIR, KNOWLEDGE_BASE_DIR
+from backend.dependencies import create_knowledge_base_service
 from backend.routers import chat, health
+from backend.services.azure_openai import AzureOpenAIService
 from backend.utils.logging_config import setup_logging
 from data.HMO_preprocessor import preprocess_hmo_html
 from backend.routers.extraction import router as extraction_router
-from backend.routers.chat import router as chat_router
 
+# set by __main__ for the uvicorn workers it starts, once it has prepared the knowledge base files for them
+_WORKER_ENV = "MEDICAL_CHATBOT_WORKER"
 
-logger = setup_logging()
+logger = setup_logging(per_process=_WORKER_ENV in os.environ)
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    logger.info("Medical Services Chatbot API starting up")
+def _html_entries(directory: Path) -> List[os.DirEntry]:
+    with os.scandir(directory) as it:
+        return [entry for entry in it if entry.is_file(follow_symlinks=False) and entry.name.endswith(".html")]
 
-    input_dir = Path("data/phase2_data")
-    output_dir = Path("data/preprocessed_hmo")
-    
-    input_dir.mkdir(parents=True, exist_ok=True)
-    output_dir.mkdir(parents=True, exist_ok=True)
-    
-    logger.info(f"Input directory: {input_dir.absolute()}")
-    logger.info(f"Output directory: {output_dir.absolute()}")
-    
-    input_files = list(input_dir.glob("*.html"))
-    logger.info(f"Found {len(input_files)} input HTML files")
+
+def _sync_knowledge_base(input_dir: Path, output_dir: Path):
+    """Preprocess the raw HMO pages into the knowledge base directory, unless its files are already up to date."""
+    input_entries = _html_entries(input_dir)
+    logger.info(f"Found {len(input_entries)} input HTML files")
     
     try:
-        if input_files:
+        output_entries = _html_entries(output_dir)
+        
+        if not input_entries:
+            logger.warning("No input HTML files found, skipping preprocessing")
+        elif output_entries and (
+            min(entry.stat().st_mtime for entry in output_entries)
+            >= max(entry.stat().st_mtime for entry in input_entries)
+        ):
+            logger.info("Preprocessed files are newer than the input files, skipping preprocessing")
+        else:
             result = preprocess_hmo_html(
                 input_dir=str(input_dir), 
-                output_dir=str(output_dir)
+                output_dir=str(output_dir),
+                filenames=[entry.name for entry in input_entries]
             )
             logger.info(f"Preprocessing result: {result}")
-        else:
-            logger.warning("No input HTML files found, skipping preprocessing")
-        
-        output_files = list(output_dir.glob("*.html"))
-        logger.info(f"Found {len(output_files)} preprocessed HTML files: {[f.name for f in output_files]}")
+            output_entries = _html_entries(output_dir)
         
-        logger.info(f"Knowledge base directory set to: {KNOWLEDGE_BASE_DIR}")
-        
-        kb_dir = Path(KNOWLEDGE_BASE_DIR)
-        if kb_dir.absolute() != output_dir.absolute():
-            logger.info(f"Creating symbolic link from {output_dir.absolute()} to {kb_dir.absolute()}")
-            kb_dir.mkdir(parents=True, exist_ok=True)
-            
-            for file in output_files:
-                target = kb_dir / file.name
-                if not target.exists():
-                    import shutil
-                    shutil.copy2(file, target)
-                    logger.info(f"Copied {file.name} to {target}")
+        logger.info(f"Found {len(output_entries)} preprocessed HTML files: {[entry.name for entry in output_entries]}")
     
     except Exception as e:
         logger.error(f"Error during startup: {str(e)}")
-        import traceback
-        logger.error(f"Traceback: {traceback.format_exc()}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.error(f"Traceback: {traceback.format_exc()}")
+
+
+async def _prepare_knowledge_base(app: FastAPI, input_dir: Path, output_dir: Path):
+    # a worker only reads what the parent process already wrote
+    if _WORKER_ENV not in os.environ:
+        await asyncio.to_thread(_sync_knowledge_base, input_dir, output_dir)
+    # built once here so no request ever pays for parsing the knowledge base
+    kb = await asyncio.to_thread(create_knowledge_base_service)
+    
+    openai_service: AzureOpenAIService = app.state.openai
+    if openai_service.embedding_deployment:
+        await kb.build_indexes(openai_service.embed_texts, openai_service.embedding_deployment)
+    else:
+        logger.info("No embeddings deployment configured, Q&A prompts will carry the full knowledge base")
+    
+    app.state.kb = kb
+
+
+@asynccontextmanager
+async def openai_lifespan(app: FastAPI):
+    # one service and connection pool for the whole process, handed to routes via Depends
+    app.state.openai = AzureOpenAIService(
+        http_client=httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+            # completions can take a while to generate, everything else should be quick
+            timeout=httpx.Timeout(connect=5, read=60, write=10, pool=5)
+        )
+    )
+    try:
+        yield
+    finally:
+        await app.state.openai.close()
+
+
+@asynccontextmanager
+async def knowledge_base_lifespan(app: FastAPI):
+    input_dir = RAW_HTML_DIR
+    output_dir = KNOWLEDGE_BASE_DIR
+    
+    input_dir.mkdir(parents=True, exist_ok=True)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    
+    logger.info(f"Input directory: {input_dir}")
+    logger.info(f"Output directory: {output_dir}")
+
+    # preprocessing runs in a worker thread so the server starts accepting requests right away;
+    # routes that need the knowledge base wait for this task through their dependency
+    app.state.preprocess_task = asyncio.create_task(
+        _prepare_knowledge_base(app, input_dir, output_dir)
+    )
+    try:
+        yield
+    finally:
+        app.state.preprocess_task.cancel()
 
-    yield
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger.info("Medical Services Chatbot API starting up")
+
+    async with AsyncExitStack() as stack:
+        await stack.enter_async_context(openai_lifespan(app))
+        await stack.enter_async_context(knowledge_base_lifespan(app))
+        yield
     
     logger.info("Medical Services Chatbot API shutting down")
 
@@ -78,21 +137,21 @@ app = FastAPI(
     title="Medical Services Chatbot API",
     description="A microservice for answering questions about Israeli health funds",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=settings.CORS_ORIGINS,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST"],
+    allow_headers=["Content-Type", "Authorization"],
 )
 
 app.include_router(health.router, tags=["Health"])
 app.include_router(chat.router, prefix="/api/chat", tags=["Chat"])
 app.include_router(extraction_router, prefix="/api/chat", tags=["chat"])
-app.include_router(chat_router, prefix="/api/chat", tags=["chat"])
 
 
 
@@ -101,15 +160,48 @@ async def global_exception_handler(request: Request, exc: Exception):
     logger.error(f"Global exception: {exc}")
     logger.error(f"Request path: {request.url.path}")
     
-    # Get traceback
-    import traceback
-    logger.error(f"Traceback: {traceback.format_exc()}")
+    # formatting the traceback is only worth it when debugging
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.error(f"Traceback: {traceback.format_exc()}")
     
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content={"message": "An unexpected error occurred. Please try again later."}
     )
 
 
+async def _prepare_shared_files():
+    """Write, once, everything each worker's lifespan would otherwise write at the same time as the others."""
+    RAW_HTML_DIR.mkdir(parents=True, exist_ok=True)
+    KNOWLEDGE_BASE_DIR.mkdir(parents=True, exist_ok=True)
+    
+    await asyncio.to_thread(_sync_knowledge_base, RAW_HTML_DIR, KNOWLEDGE_BASE_DIR)
+    # saves the parsed-text cache the workers load
+    kb = await asyncio.to_thread(create_knowledge_base_service)
+    
+    openai_service = AzureOpenAIService()
+    try:
+        if openai_service.embedding_deployment:
+            # saves the embeddings the workers load
+            await kb.build_indexes(openai_service.embed_texts, openai_service.embedding_deployment)
+    finally:
+        await openai_service.close()
+
+
 if __name__ == "__main__":
-    uvicorn.run("app:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    workers = 1 if settings.DEBUG else settings.WORKERS
+    if workers > 1:
+        asyncio.run(_prepare_shared_files())
+        # inherited by the spawned workers
+        os.environ[_WORKER_ENV] = "1"
+    
+    # uvloop has no Windows build; the reloader only supports a single worker
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=8000,
+        reload=settings.DEBUG,
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+        workers=workers
+    )
\ No newline at end of file
@@ -1,24 +1,39 @@
 from pydantic_settings import BaseSettings
-from typing import Literal
+from typing import List, Literal
 from pathlib import Path
 
 
-RAW_COMBINED_HTML_PATH = Path("data\combined_data.html")
-KNOWLEDGE_BASE_DIR = Path("data\preprocessed_hmo")
+# resolved once against the package location, so paths work on any OS and from any working directory
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+RAW_HTML_DIR = DATA_DIR / "phase2_data"
+RAW_COMBINED_HTML_PATH = DATA_DIR / "combined_data.html"
+KNOWLEDGE_BASE_DIR = DATA_DIR / "preprocessed_hmo"
+EMBEDDINGS_DIR = DATA_DIR / "embeddings"
 
 class Settings(BaseSettings):
     DEBUG: bool = False
     API_VERSION: str = "v1"
+    # uvicorn worker processes (ignored with DEBUG, whose reloader runs one). Each holds its own
+    # knowledge base, retrieval indexes and response cache, so raise it only for more CPU-bound throughput
+    WORKERS: int = 1
 
     AZURE_OPENAI_ENDPOINT: str
     AZURE_OPENAI_API_KEY: str  
     AZURE_OPENAI_DEPLOYMENT_INFO: str
     AZURE_OPENAI_DEPLOYMENT_QA: str
-    AZURE_OPENAI_API_VERSION: str = "2023-05-15"
+    # optional; enables knowledge base retrieval and the semantic layer of the Q&A response cache
+    AZURE_OPENAI_DEPLOYMENT_EMBEDDING: str = ""
+    # structured outputs (json_schema response_format) need 2024-08-01-preview or later
+    AZURE_OPENAI_API_VERSION: str = "2024-10-21"
+    # retries of throttled (429), 5xx, timed-out and dropped requests, with jittered exponential
+    # backoff that honours Retry-After; the SDK default is 2
+    AZURE_OPENAI_MAX_RETRIES: int = 3
 
     LOG_LEVEL: Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"] = "INFO"
     LOG_DIR: Path = Path("./logs")
     API_URL: str = "http://localhost:8000"
+    # browser origins allowed to call the API (JSON list in the environment)
+    CORS_ORIGINS: List[str] = ["http://localhost:8501"]
 
     class Config:
         env_file = ".env"
@@ -2,20 +2,22 @@
 Application dependencies for dependency injection.
 """
 import os
+import asyncio
 import logging
-from functools import lru_cache
 from typing import Optional
 
+from fastapi import Request
+
+from backend.services.azure_openai import AzureOpenAIService
 from backend.services.knowledge_base import KnowledgeBaseService
 from backend.config import KNOWLEDGE_BASE_DIR
 
 logger = logging.getLogger(__name__)
 
-@lru_cache()
-def get_knowledge_base_service() -> KnowledgeBaseService:
+def create_knowledge_base_service() -> KnowledgeBaseService:
     """
     Factory function for KnowledgeBaseService.
-    This is cached so only one instance is created.
+    Called once from the app lifespan; routes get the instance from app.state.
     """
     logger.info(f"Creating KnowledgeBaseService with dir: {KNOWLEDGE_BASE_DIR}")
     
@@ -37,3 +39,17 @@ def get_knowledge_base_service() -> KnowledgeBaseService:
         
     return service
 
+def get_openai_service(request: Request) -> AzureOpenAIService:
+    """
+    Return the AzureOpenAIService created in the app lifespan.
+    It is shared by all requests so its HTTP connections are reused.
+    """
+    return request.app.state.openai
+
+async def get_knowledge_base_service(request: Request) -> KnowledgeBaseService:
+    """
+    Return the KnowledgeBaseService built in the app lifespan,
+    waiting for startup preprocessing if it is still running.
+    """
+    await asyncio.shield(request.app.state.preprocess_task)
+    return request.app.state.kb
\ No newline at end of file
@@ -1,7 +1,8 @@
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, Field
 import re
 from typing import List, Optional, Dict, Any
 from enum import Enum
+from typing_extensions import TypedDict
 
 class Language(str, Enum):
     ENGLISH = "en"
@@ -25,33 +26,26 @@ class InsuranceTier(str, Enum):
 class UserInformation(BaseModel):
     first_name: str = Field(..., min_length=1, max_length=50)
     last_name: str = Field(..., min_length=1, max_length=50)
-    id_number: str = Field(..., min_length=9, max_length=9)
+    id_number: str = Field(..., pattern=r"^\d{9}$")
     gender: Gender
     age: int = Field(..., ge=0, le=120)
     hmo: HMO
-    hmo_card_number: str = Field(..., min_length=9, max_length=9)
+    hmo_card_number: str = Field(..., pattern=r"^\d{9}$")
     insurance_tier: InsuranceTier
     language: Language = Language.ENGLISH
 
-    @validator('id_number', 'hmo_card_number')
-    def validate_numeric_field(cls, v):
-        if not v.isdigit():
-            raise ValueError("Must contain only digits")
-        return v
-    
-    @validator('id_number')
-    def validate_id_number(cls, v):
-        # Israeli ID validation - simple version
-        if not v.isdigit() or len(v) != 9:
-            raise ValueError("ID number must be 9 digits")
-        return v
-
-class Message(BaseModel):
+class Message(TypedDict):
+    # same shape as an OpenAI chat message, so history is passed through as-is
     role: str
     content: str
 
 class ChatHistory(BaseModel):
     messages: List[Message] = []
+    # running summary of messages[:summary_upto], which are no longer sent to the model
+    summary: str = ""
+    summary_upto: int = Field(0, ge=0)
+    # index of the first message of the Q&A phase, set on its first turn; None until then
+    qa_start: Optional[int] = Field(None, ge=0)
 
 class ChatRequest(BaseModel):
     user_info: Optional[UserInformation] = None
@@ -61,4 +55,10 @@ class ChatRequest(BaseModel):
 
 class ChatResponse(BaseModel):
     response: str
-    updated_chat_history: ChatHistory
\ No newline at end of file
+    updated_chat_history: ChatHistory
+
+class TurnRequest(ChatRequest):
+    check_confirmation: bool = False
+
+class TurnResponse(ChatResponse):
+    is_confirmation: Optional[bool] = None
\ No newline at end of file
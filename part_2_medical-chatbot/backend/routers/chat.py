@@ -1,99 +1,287 @@
 from fastapi import APIRouter, HTTPException, Depends, Request, status
+from fastapi.responses import StreamingResponse
+import asyncio
 import logging
-from typing import Dict
+from itertools import islice
+import orjson
+from typing import Dict, List, Tuple
 
-from backend.models import ChatRequest, ChatResponse, Message, ChatHistory
+from backend.models import ChatRequest, ChatResponse, Message, ChatHistory, TurnRequest, TurnResponse
 from backend.services.azure_openai import AzureOpenAIService
 from backend.services.knowledge_base import KnowledgeBaseService
-from backend.dependencies import get_knowledge_base_service
+from backend.dependencies import get_knowledge_base_service, get_openai_service
+from backend.utils.helpers import count_message_tokens, detect_language
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
-openai_service = AzureOpenAIService()
+
+GENERATE_MESSAGE_SYSTEM_PROMPT = "You are a helpful assistant that generates natural, friendly messages for a healthcare chatbot. Respond in the requested language."
+
+# System prompt for confirmation detection
+CONFIRM_SYSTEM_PROMPT = """
+Your task is to determine if a user message is confirming their personal information.
+Analyze the intent of the message and set "confirmed" to true if the message appears to be 
+confirming information, or to false if it does not.
+
+Examples of confirmation messages:
+- "Yes, that's correct"
+- "The information looks good"
+- "כן, הפרטים נכונים" (Hebrew: "Yes, the details are correct")
+
+Examples of non-confirmation messages:
+- "I have a question"
+- "That's not right"
+- "What services does my insurance cover?"
+"""
+
+CONFIRM_USER_TEMPLATE = """
+The user has been providing their personal information for healthcare services.
+The system has summarized their information and asked them to confirm if it's correct.
+
+The user's response is: "{message}"
+
+Is this a confirmation of their information?
+"""
+
+async def _generate_reply(
+    request: ChatRequest,
+    formatted_messages: List[Message],
+    kb_service: KnowledgeBaseService,
+    openai_service: AzureOpenAIService
+) -> str:
+    """Produce the assistant reply for either the information collection or the Q&A phase."""
+    message = request.message
+    detected_language = detect_language(message)
+    
+    response_language = detected_language
+    logger.info("Detected language: %s for message: '%.50s...'", response_language, message)
+    
+    if not request.user_info:
+        logger.info("Processing information collection phase")
+        return await openai_service.get_user_information(
+            formatted_messages, 
+            request.language  
+        )
+    
+    logger.info("Processing Q&A phase for HMO: %s", request.user_info.hmo)
+    
+    knowledge_base = kb_service.get_knowledge_for_hmo(request.user_info.hmo.value, format_type="text")
+    
+    # these build sizeable strings, so skip them entirely unless debugging
+    if logger.isEnabledFor(logging.DEBUG):
+        if hasattr(kb_service, 'hmo_data'):
+            logger.debug("Available HMOs: %s", list(kb_service.hmo_data))
+        logger.debug("Knowledge base found: %s", knowledge_base is not None)
+        if knowledge_base:
+            logger.debug("Knowledge base snippet: %s", knowledge_base[:300])
+        logger.debug("Received user_info: %s", request.user_info)
+
+    if not knowledge_base:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Knowledge base for HMO {request.user_info.hmo} not found"
+        )
+    
+    return await openai_service.get_qa_response(
+        formatted_messages,
+        request.user_info.model_dump(),
+        knowledge_base,
+        response_language,  # Use detected language for response
+        index=kb_service.get_index(request.user_info.hmo.value),
+        first_question=_is_first_question(request)
+    )
+
+# once the unsummarized history exceeds the token budget, everything but the last few
+# messages is folded into the running summary, so prompt size stays bounded
+HISTORY_TOKEN_LIMIT = 3000
+HISTORY_KEEP_MESSAGES = 6
+
+async def _prepare_history(request: ChatRequest, openai_service: AzureOpenAIService) -> Tuple[List[Message], str, int]:
+    """
+    Return the messages to send to the model for this turn,
+    along with the (possibly updated) summary and the number of messages it covers.
+    """
+    messages = request.chat_history.messages
+    summary = request.chat_history.summary
+    summary_upto = min(request.chat_history.summary_upto, len(messages))
+    
+    if (len(messages) - summary_upto > HISTORY_KEEP_MESSAGES
+            and count_message_tokens(islice(messages, summary_upto, None)) > HISTORY_TOKEN_LIMIT):
+        try:
+            summary = await openai_service.summarize_history(messages[summary_upto:-HISTORY_KEEP_MESSAGES], summary)
+            summary_upto = len(messages) - HISTORY_KEEP_MESSAGES
+        except Exception as e:
+            # sending the full history is slower, not wrong
+            logger.warning("Could not summarize chat history, sending it in full: %s", e)
+    
+    # built in a single pass over the history, without intermediate slices
+    prompt_messages = [Message(role="system", content=f"Summary of the earlier conversation:\n{summary}")] if summary else []
+    prompt_messages.extend(islice(messages, summary_upto, None))
+    prompt_messages.append(Message(role="user", content=request.message))
+    return prompt_messages, summary, summary_upto
+
+def _is_first_question(request: ChatRequest) -> bool:
+    # the first question of the Q&A phase doesn't refer back to earlier answers, so it can be answered on its own
+    return request.user_info is not None and request.chat_history.qa_start is None
+
+def _updated_history(request: ChatRequest, response_content: str, summary: str, summary_upto: int) -> ChatHistory:
+    # the request model only lives for this call, so extend its history in place instead of copying it
+    history = request.chat_history
+    if _is_first_question(request):
+        history.qa_start = len(history.messages)
+    history.messages.append(Message(role="user", content=request.message))
+    history.messages.append(Message(role="assistant", content=response_content))
+    history.summary = summary
+    history.summary_upto = summary_upto
+    return history
+
+def _confirmation_messages(message: str) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": CONFIRM_SYSTEM_PROMPT},
+        {"role": "user", "content": CONFIRM_USER_TEMPLATE.format(message=message)}
+    ]
 
 @router.post("/chat", response_model=ChatResponse)
 async def chat(
     request: ChatRequest,
-    kb_service: KnowledgeBaseService = Depends(get_knowledge_base_service)
+    kb_service: KnowledgeBaseService = Depends(get_knowledge_base_service),
+    openai_service: AzureOpenAIService = Depends(get_openai_service)
 ):
     try:
-        message = request.message
-        detected_language = "he" if any(hebrew_char in message for hebrew_char in "אבגדהוזחטיכלמנסעפצקרשת") else "en"
+        formatted_messages, summary, summary_upto = await _prepare_history(request, openai_service)
         
-        response_language = detected_language
-        logger.info(f"Detected language: {response_language} for message: '{message[:50]}...'")
+        response_content = await _generate_reply(request, formatted_messages, kb_service, openai_service)
         
-        formatted_messages = [
-            {"role": msg.role, "content": msg.content}
-            for msg in request.chat_history.messages
-        ]
+        updated_history = _updated_history(request, response_content, summary, summary_upto)
+        
+        return ChatResponse(
+            response=response_content,
+            updated_chat_history=updated_history
+        )
         
-        formatted_messages.append({"role": "user", "content": request.message})
+    except HTTPException as e:
+        logger.error("HTTP exception in chat endpoint: %s", e)
+        raise
         
-        if not request.user_info:
-            logger.info("Processing information collection phase")
-            response_content = await openai_service.get_user_information(
-                formatted_messages, 
-                request.language  
-            )
-        else:
-            logger.info(f"Processing Q&A phase for HMO: {request.user_info.hmo}")
-            
-            if hasattr(kb_service, 'hmo_data'):
-                logger.info(f"Available HMOs: {list(kb_service.hmo_data.keys())}")
-            
-            knowledge_base = kb_service.get_knowledge_for_hmo(request.user_info.hmo, format_type="text")
-            logger.info(f"[DEBUG] Knowledge base found: {knowledge_base is not None}")
-            
-            if knowledge_base:
-                logger.info(f"[DEBUG] Knowledge base snippet: {knowledge_base[:300]}")
-            
-            logger.info(f"[DEBUG] Received user_info: {request.user_info}")
+    except Exception as e:
+        logger.error("Error processing chat request: %s", e)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An error occurred while processing your request: {str(e)}"
+        )
 
-            if not knowledge_base:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail=f"Knowledge base for HMO {request.user_info.hmo} not found"
-                )
-            
-            response_content = await openai_service.get_qa_response(
-                formatted_messages,
-                request.user_info.dict(),
-                knowledge_base,
-                response_language  # Use detected language for response
+@router.post("/turn", response_model=TurnResponse)
+async def turn(
+    request: TurnRequest,
+    kb_service: KnowledgeBaseService = Depends(get_knowledge_base_service),
+    openai_service: AzureOpenAIService = Depends(get_openai_service)
+):
+    """
+    One conversation turn in a single round trip: the chat reply and, when requested,
+    the confirmation check for the same message, with both model calls in flight together.
+    """
+    try:
+        formatted_messages, summary, summary_upto = await _prepare_history(request, openai_service)
+        
+        is_confirmation = None
+        if request.check_confirmation:
+            # the check runs as its own task while this one generates the reply
+            confirmation = asyncio.create_task(
+                openai_service.get_confirmation_check(_confirmation_messages(request.message), request.language)
             )
+            try:
+                response_content = await _generate_reply(request, formatted_messages, kb_service, openai_service)
+            except BaseException:
+                # nothing would ever read its result, so don't leave it running
+                confirmation.cancel()
+                raise
+            
+            try:
+                is_confirmation = await confirmation
+            except Exception as e:
+                # the reply is still worth returning; the client treats a missing answer as unknown
+                logger.warning("Confirmation check failed, returning the reply without it: %s", e)
+        else:
+            response_content = await _generate_reply(request, formatted_messages, kb_service, openai_service)
         
-        updated_history = ChatHistory(
-            messages=request.chat_history.messages + [
-                Message(role="user", content=request.message),
-                Message(role="assistant", content=response_content)
-            ]
-        )
+        updated_history = _updated_history(request, response_content, summary, summary_upto)
         
-        return ChatResponse(
+        return TurnResponse(
             response=response_content,
-            updated_chat_history=updated_history
+            updated_chat_history=updated_history,
+            is_confirmation=is_confirmation
         )
-        
+    
     except HTTPException as e:
-        logger.error(f"HTTP exception in chat endpoint: {str(e)}")
+        logger.error("HTTP exception in turn endpoint: %s", e)
         raise
-        
+    
     except Exception as e:
-        logger.error(f"Error processing chat request: {str(e)}")
+        logger.error("Error processing turn request: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"An error occurred while processing your request: {str(e)}"
         )
         
+@router.post("/chat/stream")
+async def chat_stream(
+    request: ChatRequest,
+    kb_service: KnowledgeBaseService = Depends(get_knowledge_base_service),
+    openai_service: AzureOpenAIService = Depends(get_openai_service)
+):
+    """
+    Same as /chat, but streams the reply as server-sent events.
+    Each event carries a text delta; a final "done" event carries the updated chat history.
+    """
+    message = request.message
+    response_language = detect_language(message)
+    formatted_messages, summary, summary_upto = await _prepare_history(request, openai_service)
+    
+    if not request.user_info:
+        deltas = openai_service.stream_user_information(formatted_messages, request.language)
+    else:
+        knowledge_base = kb_service.get_knowledge_for_hmo(request.user_info.hmo.value, format_type="text")
+        if not knowledge_base:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Knowledge base for HMO {request.user_info.hmo} not found"
+            )
+        deltas = openai_service.stream_qa_response(
+            formatted_messages,
+            request.user_info.model_dump(),
+            knowledge_base,
+            response_language,
+            index=kb_service.get_index(request.user_info.hmo.value),
+            first_question=_is_first_question(request)
+        )
+    
+    async def event_stream():
+        parts = []
+        try:
+            async for delta in deltas:
+                parts.append(delta)
+                yield b"data: " + orjson.dumps({"delta": delta}) + b"\n\n"
+        except Exception as e:
+            logger.error("Error streaming chat response: %s", e)
+            yield b"event: error\ndata: " + orjson.dumps({"detail": str(e)}) + b"\n\n"
+            return
+        
+        updated_history = _updated_history(request, "".join(parts), summary, summary_upto)
+        yield b"event: done\ndata: " + orjson.dumps({"updated_chat_history": updated_history.model_dump()}) + b"\n\n"
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 @router.post("/generate_message", response_model=Dict[str, str])
-async def generate_system_message(request: Request):
+async def generate_system_message(
+    request: Request,
+    openai_service: AzureOpenAIService = Depends(get_openai_service)
+):
     """
     Generate a system message in the specified language.
     Used for creating dynamic UI messages without hardcoding.
     """
     try:
-        data = await request.json()
+        data = orjson.loads(await request.body())
         prompt = data.get("prompt", "")
         language = data.get("language", "en")
         
@@ -103,7 +291,7 @@ async def generate_system_message(request: Request):
         
         # Format messages for the API call
         formatted_messages = [
-            {"role": "system", "content": "You are a helpful assistant that generates natural, friendly messages for a healthcare chatbot. Respond in the requested language."},
+            {"role": "system", "content": GENERATE_MESSAGE_SYSTEM_PROMPT},
             {"role": "user", "content": prompt}
         ]
         
@@ -112,68 +300,39 @@ async def generate_system_message(request: Request):
             language
         )
         
-        logger.info(f"Generated system message for language '{language}'")
+        logger.info("Generated system message for language '%s'", language)
         return {"message": response_content.strip()}
         
     except Exception as e:
-        logger.error(f"Error in generate_system_message: {str(e)}")
+        logger.error("Error in generate_system_message: %s", e)
         return {"message": ""}
     
 @router.post("/confirm_intent", response_model=Dict[str, bool])
-async def confirm_intent(request: Request):
+async def confirm_intent(
+    request: Request,
+    openai_service: AzureOpenAIService = Depends(get_openai_service)
+):
     try:
-        data = await request.json()
+        data = orjson.loads(await request.body())
         message = data.get("message", "")
         language = data.get("language", "en")
         
         if not message:
             return {"is_confirmation": False}
         
-        # System prompt for confirmation detection
-        system_prompt = """
-        Your task is to determine if a user message is confirming their personal information.
-        Analyze the intent of the message and respond with ONLY "true" if the message appears to be 
-        confirming information, or "false" if it does not.
-        
-        Examples of confirmation messages:
-        - "Yes, that's correct"
-        - "The information looks good"
-        - "כן, הפרטים נכונים" (Hebrew: "Yes, the details are correct")
-        
-        Examples of non-confirmation messages:
-        - "I have a question"
-        - "That's not right"
-        - "What services does my insurance cover?"
-        """
-        
-        user_prompt = f"""
-        The user has been providing their personal information for healthcare services.
-        The system has summarized their information and asked them to confirm if it's correct.
-        
-        The user's response is: "{message}"
+        formatted_messages = _confirmation_messages(message)
         
-        Is this a confirmation of their information? Respond with ONLY the word "true" or "false".
-        """
-        
-        formatted_messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
-        
-        response_content = await openai_service.get_confirmation_check(
+        is_confirmation = await openai_service.get_confirmation_check(
             formatted_messages, 
             language
         )
         
-        response_text = response_content.strip().lower()
-        is_confirmation = response_text == "true"
-        
-        logger.info(f"Confirmation check: '{message}' -> {is_confirmation}")
+        logger.info("Confirmation check: '%s' -> %s", message, is_confirmation)
         
         return {"is_confirmation": is_confirmation}
         
     except Exception as e:
-        logger.error(f"Error in confirmation check: {str(e)}")
+        logger.error("Error in confirmation check: %s", e)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"An error occurred during confirmation check: {str(e)}"
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, Request, Response, status
 import logging
 from datetime import datetime
 from typing import Dict, Any
@@ -7,13 +7,24 @@ router = APIRouter()
 logger = logging.getLogger(__name__)
 
 @router.get("/health")
-async def health_check() -> Dict[str, Any]:
+async def health_check(request: Request, response: Response) -> Dict[str, Any]:
     """
     Health check endpoint to verify the API is up and running.
     """
     try:
+        task = request.app.state.preprocess_task
+        if not task.done():
+            kb_status = "loading"
+        elif task.cancelled() or task.exception() is not None:
+            # every route that needs the knowledge base re-raises this failure, so the service is not usable
+            kb_status = "failed"
+            response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        else:
+            kb_status = "ready"
+        
         return {
-            "status": "ok",
+            "status": "error" if kb_status == "failed" else "ok",
+            "knowledge_base": kb_status,
             "timestamp": datetime.now().isoformat(),
             "message": "Medical Services Chatbot API is running"
         }
@@ -1,24 +1,187 @@
 import os
 import logging
-import json
-from typing import List, Dict, Any, Optional
+import orjson
+from functools import lru_cache
+from types import MappingProxyType
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple
+import httpx
+import numpy as np
 import openai
-from openai import AzureOpenAI
+from openai import AsyncAzureOpenAI
 from backend.config import settings
+from backend.services.cache import ResponseCache, Scope
+from backend.services.retrieval import KnowledgeIndex
 
 logger = logging.getLogger(__name__)
 
+REQUIRED_FIELDS = ("first_name", "last_name", "id_number", "gender", "age", "hmo", "hmo_card_number", "insurance_tier")
+VALID_GENDERS = frozenset(("male", "female"))
+VALID_HMOS = frozenset(("מכבי", "מאוחדת", "כללית"))
+VALID_TIERS = frozenset(("ארד", "כסף", "זהב"))
+
+# normalization of extracted values, keyed by the lowercased model output
+GENDER_MAP = MappingProxyType({
+    "male": "male", "זכר": "male", "גבר": "male", "m": "male",
+    "female": "female", "נקבה": "female", "אישה": "female", "f": "female"
+})
+HMO_MAP = MappingProxyType({
+    "maccabi": "מכבי", "מכבי": "מכבי",
+    "meuhedet": "מאוחדת", "מאוחדת": "מאוחדת",
+    "clalit": "כללית", "כללית": "כללית"
+})
+TIER_MAP = MappingProxyType({
+    "bronze": "ארד", "ארד": "ארד",
+    "silver": "כסף", "כסף": "כסף",
+    "gold": "זהב", "זהב": "זהב"
+})
+
+def _is_nine_digits(value: Any) -> bool:
+    return isinstance(value, str) and len(value) == 9 and value.isdecimal()
+
+def _build_messages(system_message: str, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    # builds the prompt list once; [system] + messages also allocates a throwaway one-item list first
+    return [{"role": "system", "content": system_message}, *messages]
+
+def _nullable(json_type: str, enum: Optional[List[str]] = None) -> Dict[str, Any]:
+    schema = {"type": [json_type, "null"]}
+    if enum:
+        schema["enum"] = [*enum, None]
+    return schema
+
+# structured-output schema for extract_user_info; strict mode requires every field, so missing ones are null
+USER_INFO_SCHEMA = {
+    "name": "UserInfo",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "first_name": _nullable("string"),
+            "last_name": _nullable("string"),
+            "id_number": _nullable("string"),
+            "gender": _nullable("string", ["male", "female"]),
+            "age": _nullable("integer"),
+            "hmo": _nullable("string", ["מכבי", "מאוחדת", "כללית"]),
+            "hmo_card_number": _nullable("string"),
+            "insurance_tier": _nullable("string", ["ארד", "כסף", "זהב"]),
+        },
+        "required": list(REQUIRED_FIELDS),
+        "additionalProperties": False,
+    },
+}
+
+# structured-output schema for get_confirmation_check: a single boolean the caller can read directly
+CONFIRMATION_SCHEMA = {
+    "name": "Confirmation",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {"confirmed": {"type": "boolean"}},
+        "required": ["confirmed"],
+        "additionalProperties": False,
+    },
+}
+
 class AzureOpenAIService:
-    def __init__(self):
+    INFO_PROMPT_HE = """
+            אתה עוזר אדיב שמסייע לאסוף מידע ממשתמשים עבור שירותי בריאות בישראל.
+            עליך לאסוף את הפרטים הבאים:
+            1. שם פרטי ושם משפחה
+            2. מספר תעודת זהות (9 ספרות תקינות)
+            3. מגדר (זכר/נקבה/אחר)
+            4. גיל (בין 0 ל-120)
+            5. שם קופת החולים (מכבי או מאוחדת או כללית)
+            6. מספר כרטיס קופת החולים (9 ספרות)
+            7. דרגת ביטוח (זהב או כסף או ארד)
+                
+            אנא אסוף את המידע שלב אחר שלב, ואמת שהוא תקין. אם מידע חסר או לא תקין, בקש מהמשתמש לתקן אותו.
+            בסוף התהליך, רק סכם את כל המידע שנאסף ללא בקשת אישור. אין צורך לבקש אישור מהמשתמש.
+            הודע למשתמש שהוא יכול להתחיל לשאול שאלות על שירותי הבריאות של קופת החולים שלו.
+
+            """
+    
+    INFO_PROMPT_EN = """
+            You are a helpful assistant that collects information from users for healthcare services in Israel.
+            You need to collect the following details:
+            1. First and last name
+            2. ID number (valid 9-digit number)
+            3. Gender (male/female/other)
+            4. Age (between 0 and 120)
+            5. HMO name (מכבי or מאוחדת or כללית)
+            6. HMO card number (9-digit)
+            7. Insurance membership tier (זהב or כסף or ארד)
+            
+            Please collect the information step by step, and validate that it is correct. If information is missing or invalid, ask the user to correct it.
+            At the end of the process, simply summarize the collected information WITHOUT asking for confirmation. 
+            DO NOT ask the user to confirm the information or details.
+            Inform the user that they can start asking questions about their HMO's healthcare services.
+            """
+    
+    HISTORY_SUMMARY_PROMPT = """
+            Summarize the following conversation between a user and a healthcare services assistant.
+            Keep every personal detail the user provided (name, ID number, gender, age, HMO, HMO card number,
+            insurance tier), the questions they asked and the key facts of the answers.
+            Write it in the language of the conversation, as briefly as possible.
+            """
+    
+    # (head, tail) of the Q&A system prompt; the knowledge base goes between them
+    QA_PROMPT_HE = (
+        """
+            אתה עוזר אדיב שעונה על שאלות לגבי שירותי בריאות בישראל.
+            
+            פרטי המשתמש:
+            קופת חולים: {hmo}
+            דרגת ביטוח: {tier}
+            
+            עליך להשתמש במידע המצורף כבסיס הידע שלך כדי לענות על שאלות המשתמש:
+            
+            """,
+        """
+            
+            כאשר אתה עונה על שאלות:
+            1. השתמש רק במידע שסופק בבסיס הידע.
+            2. התאם את התשובות לקופת החולים ודרגת הביטוח של המשתמש.
+            3. אם אינך יודע את התשובה או שהמידע אינו זמין בבסיס הידע, ציין זאת בבירור.
+            4. אתה חייב לענות בעברית כאשר המשתמש שואל בעברית. אל תתרגם את המידע בעברית לאנגלית כאשר המשתמש שואל בעברית.
+            """
+    )
+    
+    QA_PROMPT_EN = (
+        """
+            You are a helpful assistant that answers questions about healthcare services in Israel.
+            
+            User Information:
+            HMO: {hmo}
+            Insurance Tier: {tier}
+            
+            You should use the following information as your knowledge base to answer the user's questions:
+            
+            """,
+        """
+            
+            When answering questions:
+            1. Only use information provided in the knowledge base.
+            2. Tailor the answers to the user's HMO and insurance tier.
+            3. If you don't know the answer or the information is not available in the knowledge base, clearly state that.
+            4. When the user asks in English, you must translate any Hebrew content from the knowledge base to English in your responses.
+            5. Make sure that you're detecting the language of the user's query correctly - if they ask in Hebrew, respond in Hebrew.
+            """
+    )
+    
+    def __init__(self, http_client: Optional[httpx.AsyncClient] = None):
         """Initialize the Azure OpenAI service."""
-        self.client = AzureOpenAI(
+        self.client = AsyncAzureOpenAI(
             api_key=settings.AZURE_OPENAI_API_KEY,
             api_version=settings.AZURE_OPENAI_API_VERSION,
-            azure_endpoint=settings.AZURE_OPENAI_ENDPOINT
+            azure_endpoint=settings.AZURE_OPENAI_ENDPOINT,
+            http_client=http_client,
+            # the SDK retries transient failures itself, so Azure throttling rarely reaches the user as a 500
+            max_retries=settings.AZURE_OPENAI_MAX_RETRIES
         )
         
         self.info_deployment = settings.AZURE_OPENAI_DEPLOYMENT_INFO
         self.qa_deployment = settings.AZURE_OPENAI_DEPLOYMENT_QA
+        self.embedding_deployment = settings.AZURE_OPENAI_DEPLOYMENT_EMBEDDING
+        self.response_cache = ResponseCache()
         
         self._validate_configuration()
         logger.info("Azure OpenAI service initialized successfully")
@@ -36,9 +199,9 @@ class AzureOpenAIService:
     async def get_user_information(self, messages: List[Dict[str, str]], language: str) -> str:
         try:
             system_message = self._get_info_collection_system_prompt(language)
-            all_messages = [{"role": "system", "content": system_message}] + messages
+            all_messages = _build_messages(system_message, messages)
             
-            response = self.client.chat.completions.create(
+            response = await self.client.chat.completions.create(
                 model=self.info_deployment,
                 messages=all_messages,
                 temperature=0.3,
@@ -56,12 +219,23 @@ class AzureOpenAIService:
             logger.error(f"Error in get_user_information: {str(e)}")
             raise
     
-    async def get_qa_response(self, messages: List[Dict[str, str]], user_info: Dict[str, Any], knowledge_base: str, language: str) -> str:
+    async def get_qa_response(
+        self,
+        messages: List[Dict[str, str]],
+        user_info: Dict[str, Any],
+        knowledge_base: str,
+        language: str,
+        index: Optional[KnowledgeIndex] = None,
+        first_question: bool = False
+    ) -> str:
         try:
-            system_message = self._get_qa_system_prompt(user_info, knowledge_base, language)
-            all_messages = [{"role": "system", "content": system_message}] + messages
+            cached, cache_slot, all_messages = await self._prepare_qa(
+                messages, user_info, knowledge_base, language, index, first_question
+            )
+            if cached is not None:
+                return cached
             
-            response = self.client.chat.completions.create(
+            response = await self.client.chat.completions.create(
                 model=self.qa_deployment,
                 messages=all_messages,
                 temperature=0.5,
@@ -73,111 +247,205 @@ class AzureOpenAIService:
             
             content = response.choices[0].message.content
             logger.info("Successfully obtained Q&A response")
+            
+            if cache_slot is not None:
+                self._cache_qa_answer(*cache_slot, content)
             return content
                 
         except Exception as e:
             logger.error(f"Error in get_qa_response: {str(e)}")
             raise
     
+    async def _prepare_qa(
+        self,
+        messages: List[Dict[str, str]],
+        user_info: Dict[str, Any],
+        knowledge_base: str,
+        language: str,
+        index: Optional[KnowledgeIndex],
+        first_question: bool
+    ) -> Tuple[Optional[str], Optional[Tuple[Scope, str, Optional[np.ndarray]]], List[Dict[str, str]]]:
+        """
+        The cached answer to the question if there is one; otherwise None, where to cache the answer
+        (only for a conversation's first question) and the messages to send to the model.
+        """
+        question = messages[-1]["content"]
+        embedding = None
+        cache_slot = None
+        
+        if first_question:
+            scope = ResponseCache.scope(user_info.get('hmo', ''), user_info.get('insurance_tier', ''), language)
+            cache_key = ResponseCache.make_key(scope, question)
+            
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                logger.info("Q&A response served from cache")
+                return cached, None, []
+            
+            embedding = await self._embed_question(question)
+            if embedding is not None:
+                cached = self.response_cache.get_similar(scope, embedding)
+                if cached is not None:
+                    logger.info("Q&A response served from semantic cache")
+                    return cached, None, []
+            
+            # the answer is shared with every user asking the same, so it is generated
+            # from the question alone, without the personal details collected before it
+            messages = messages[-1:]
+            cache_slot = (scope, cache_key, embedding)
+        elif index is not None:
+            embedding = await self._embed_question(question)
+        
+        if embedding is not None and index is not None:
+            knowledge_base = index.search(embedding)
+        
+        system_message = self._get_qa_system_prompt(user_info, knowledge_base, language)
+        return None, cache_slot, _build_messages(system_message, messages)
+    
+    def _cache_qa_answer(self, scope: Scope, cache_key: str, embedding: Optional[np.ndarray], answer: str):
+        self.response_cache.set(cache_key, answer)
+        if embedding is not None:
+            self.response_cache.add_similar(scope, embedding, answer)
+    
+    async def summarize_history(self, messages: List[Dict[str, str]], previous_summary: str) -> str:
+        """Fold older conversation turns into the running summary."""
+        transcript = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+        if previous_summary:
+            transcript = f"Summary so far:\n{previous_summary}\n\nLater messages:\n{transcript}"
+        
+        response = await self.client.chat.completions.create(
+            model=self.info_deployment,
+            messages=[
+                {"role": "system", "content": self.HISTORY_SUMMARY_PROMPT},
+                {"role": "user", "content": transcript}
+            ],
+            temperature=0.2,
+            max_tokens=400
+        )
+        
+        logger.info("Summarized %d older chat messages", len(messages))
+        return response.choices[0].message.content
+    
+    async def _embed_question(self, question: str) -> Optional[np.ndarray]:
+        """Unit-length embedding of the question, or None when no embeddings deployment is configured."""
+        if not self.embedding_deployment:
+            return None
+        try:
+            response = await self.client.embeddings.create(model=self.embedding_deployment, input=question)
+        except Exception as e:
+            # the semantic cache is an optimization; answer the question without it
+            logger.warning(f"Embedding request failed, answering without retrieval or semantic cache: {str(e)}")
+            return None
+        
+        vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+        return vector / np.linalg.norm(vector)
+    
+    async def embed_texts(self, texts: List[str]) -> np.ndarray:
+        """Unit-length embeddings of the texts, one row per text, from a single request."""
+        response = await self.client.embeddings.create(model=self.embedding_deployment, input=texts)
+        
+        vectors = np.array([item.embedding for item in sorted(response.data, key=lambda item: item.index)], dtype=np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    
+    async def stream_user_information(self, messages: List[Dict[str, str]], language: str) -> AsyncIterator[str]:
+        system_message = self._get_info_collection_system_prompt(language)
+        all_messages = _build_messages(system_message, messages)
+        
+        async for delta in self._stream_completion(
+            model=self.info_deployment,
+            messages=all_messages,
+            temperature=0.3,
+            max_tokens=1000,
+            top_p=0.95,
+            frequency_penalty=0,
+            presence_penalty=0
+        ):
+            yield delta
+    
+    async def stream_qa_response(
+        self,
+        messages: List[Dict[str, str]],
+        user_info: Dict[str, Any],
+        knowledge_base: str,
+        language: str,
+        index: Optional[KnowledgeIndex] = None,
+        first_question: bool = False
+    ) -> AsyncIterator[str]:
+        cached, cache_slot, all_messages = await self._prepare_qa(
+            messages, user_info, knowledge_base, language, index, first_question
+        )
+        if cached is not None:
+            # a cached answer goes out as a single delta
+            yield cached
+            return
+        
+        parts = []
+        async for delta in self._stream_completion(
+            model=self.qa_deployment,
+            messages=all_messages,
+            temperature=0.5,
+            max_tokens=1500,
+            top_p=0.95,
+            frequency_penalty=0,
+            presence_penalty=0
+        ):
+            parts.append(delta)
+            yield delta
+        
+        # only reached when the whole reply arrived, so an interrupted stream is never cached
+        if cache_slot is not None:
+            self._cache_qa_answer(*cache_slot, "".join(parts))
+    
+    async def _stream_completion(self, **params) -> AsyncIterator[str]:
+        """Yield the content deltas of a streamed chat completion as they arrive."""
+        stream = await self.client.chat.completions.create(stream=True, **params)
+        try:
+            async for chunk in stream:
+                # Azure sends content-filter chunks without choices
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await stream.response.aclose()
+    
     def _get_info_collection_system_prompt(self, language: str) -> str:
-        if language == "he":
-            return """
-            אתה עוזר אדיב שמסייע לאסוף מידע ממשתמשים עבור שירותי בריאות בישראל.
-            עליך לאסוף את הפרטים הבאים:
-            1. שם פרטי ושם משפחה
-            2. מספר תעודת זהות (9 ספרות תקינות)
-            3. מגדר (זכר/נקבה/אחר)
-            4. גיל (בין 0 ל-120)
-            5. שם קופת החולים (מכבי או מאוחדת או כללית)
-            6. מספר כרטיס קופת החולים (9 ספרות)
-            7. דרגת ביטוח (זהב או כסף או ארד)
-                
-            אנא אסוף את המידע שלב אחר שלב, ואמת שהוא תקין. אם מידע חסר או לא תקין, בקש מהמשתמש לתקן אותו.
-            בסוף התהליך, רק סכם את כל המידע שנאסף ללא בקשת אישור. אין צורך לבקש אישור מהמשתמש.
-            הודע למשתמש שהוא יכול להתחיל לשאול שאלות על שירותי הבריאות של קופת החולים שלו.
-
-            """
-        else:  # English
-            return """
-            You are a helpful assistant that collects information from users for healthcare services in Israel.
-            You need to collect the following details:
-            1. First and last name
-            2. ID number (valid 9-digit number)
-            3. Gender (male/female/other)
-            4. Age (between 0 and 120)
-            5. HMO name (מכבי or מאוחדת or כללית)
-            6. HMO card number (9-digit)
-            7. Insurance membership tier (זהב or כסף or ארד)
-            
-            Please collect the information step by step, and validate that it is correct. If information is missing or invalid, ask the user to correct it.
-            At the end of the process, simply summarize the collected information WITHOUT asking for confirmation. 
-            DO NOT ask the user to confirm the information or details.
-            Inform the user that they can start asking questions about their HMO's healthcare services.
-            """
+        return self.INFO_PROMPT_HE if language == "he" else self.INFO_PROMPT_EN
     
     def _get_qa_system_prompt(self, user_info: Dict[str, Any], knowledge_base: str, language: str) -> str:
         
-        name = f"{user_info.get('first_name', '')} {user_info.get('last_name', '')}"
         hmo = user_info.get('hmo', '')
         tier = user_info.get('insurance_tier', '')
         
-        if language == "he":
-            return f"""
-            אתה עוזר אדיב שעונה על שאלות לגבי שירותי בריאות בישראל.
-            
-            פרטי המשתמש:
-            שם: {name}
-            קופת חולים: {hmo}
-            דרגת ביטוח: {tier}
-            
-            עליך להשתמש במידע המצורף כבסיס הידע שלך כדי לענות על שאלות המשתמש:
-            
-            {knowledge_base}
-            
-            כאשר אתה עונה על שאלות:
-            1. השתמש רק במידע שסופק בבסיס הידע.
-            2. התאם את התשובות לקופת החולים ודרגת הביטוח של המשתמש.
-            3. אם אינך יודע את התשובה או שהמידע אינו זמין בבסיס הידע, ציין זאת בבירור.
-            4. אתה חייב לענות בעברית כאשר המשתמש שואל בעברית. אל תתרגם את המידע בעברית לאנגלית כאשר המשתמש שואל בעברית.
-            """
-        else:  # English
-            return f"""
-            You are a helpful assistant that answers questions about healthcare services in Israel.
-            
-            User Information:
-            Name: {name}
-            HMO: {hmo}
-            Insurance Tier: {tier}
-            
-            You should use the following information as your knowledge base to answer the user's questions:
-            
-            {knowledge_base}
-            
-            When answering questions:
-            1. Only use information provided in the knowledge base.
-            2. Tailor the answers to the user's HMO and insurance tier.
-            3. If you don't know the answer or the information is not available in the knowledge base, clearly state that.
-            4. When the user asks in English, you must translate any Hebrew content from the knowledge base to English in your responses.
-            5. Make sure that you're detecting the language of the user's query correctly - if they ask in Hebrew, respond in Hebrew.
-            """
+        head, tail = self._qa_prompt_template(hmo, tier, language)
+        # the knowledge base, the bulk of the prompt, is joined in without going through the formatter
+        return "".join((head, knowledge_base, tail))
+    
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def _qa_prompt_template(hmo: str, tier: str, language: str) -> Tuple[str, str]:
+        # only a handful of HMO/tier/language combinations exist, so each head is formatted once;
+        # the knowledge base stays out of the key, as with retrieval it differs for every question
+        head, tail = AzureOpenAIService.QA_PROMPT_HE if language == "he" else AzureOpenAIService.QA_PROMPT_EN
+        return head.format(hmo=hmo, tier=tier), tail
             
     
     
-    async def get_confirmation_check(self, messages: List[Dict[str, str]], language: str) -> str:
+    async def get_confirmation_check(self, messages: List[Dict[str, str]], language: str) -> bool:
         try:
-            response = self.client.chat.completions.create(
+            # the schema leaves the model a single boolean to fill in, so a few tokens of output are enough
+            response = await self.client.chat.completions.create(
                 model=self.info_deployment, 
                 messages=messages,
+                response_format={"type": "json_schema", "json_schema": CONFIRMATION_SCHEMA},
                 temperature=0.1,  
-                max_tokens=5,     
+                max_tokens=10,     
                 top_p=0.95,
                 frequency_penalty=0,
                 presence_penalty=0
             )
             
-            content = response.choices[0].message.content
+            confirmed = orjson.loads(response.choices[0].message.content)["confirmed"]
             logger.info("Successfully obtained confirmation check response")
-            return content
+            return confirmed
             
         except Exception as e:
             logger.error(f"Error in get_confirmation_check: {str(e)}")
@@ -208,78 +476,39 @@ class AzureOpenAIService:
             - For HMO names in English (Maccabi, Meuhedet, Clalit), convert to Hebrew (מכבי, מאוחדת, כללית)
             - For insurance tiers in English (Bronze, Silver, Gold), convert to Hebrew (ארד, כסף, זהב)
             
-            Return ONLY a valid JSON object with these fields. If a field cannot be extracted, exclude it.
-            """
-            
-            example_message = """
-            Here's a summary of your information:
-            1. Name: ישראל ישראלי / Israel Israeli
-            2. ID: 123456789
-            3. Gender: Male / זכר
-            4. Age: 35
-            5. HMO: מכבי / Maccabi
-            6. HMO Card Number: 987654321
-            7. Insurance Tier: זהב / Gold
-            """
-            
-            example_response = """
-            {
-                "first_name": "ישראל",
-                "last_name": "ישראלי",
-                "id_number": "123456789",
-                "gender": "male",
-                "age": "35",
-                "hmo": "מכבי",
-                "hmo_card_number": "987654321",
-                "insurance_tier": "זהב"
-            }
+            Return ONLY a valid JSON object with these fields. If a field cannot be extracted, set it to null.
             """
             
             logger.debug(f"Sending the following text to LLM for extraction: {summary_text[:100]}...")
             
             messages = [
                 {"role": "system", "content": system_message},
-                {"role": "user", "content": example_message},
-                {"role": "assistant", "content": example_response},
                 {"role": "user", "content": summary_text}
             ]
             
-            response = self.client.chat.completions.create(
+            # the strict schema pins down the output shape, so no few-shot example is needed
+            response = await self.client.chat.completions.create(
                 model=self.info_deployment,
                 messages=messages,
-                response_format={"type": "json_object"},
+                response_format={"type": "json_schema", "json_schema": USER_INFO_SCHEMA},
                 temperature=0.1  
             )
             
             extracted_json = response.choices[0].message.content
             logger.debug(f"LLM response: {extracted_json}")
             
-            # Parse and validate the response
-            user_info = json.loads(extracted_json)
+            # Parse the response; fields the model could not extract come back as null
+            user_info = {key: value for key, value in orjson.loads(extracted_json).items() if value is not None}
             
             # Normalize fields as needed
             if "gender" in user_info:
-                gender_mapping = {
-                    "male": "male", "זכר": "male", "גבר": "male", "m": "male",
-                    "female": "female", "נקבה": "female", "אישה": "female", "f": "female"
-                }
-                user_info["gender"] = gender_mapping.get(user_info["gender"].lower(), user_info["gender"])
+                user_info["gender"] = GENDER_MAP.get(user_info["gender"].lower(), user_info["gender"])
             
             if "hmo" in user_info:
-                hmo_mapping = {
-                    "maccabi": "מכבי", "מכבי": "מכבי",
-                    "meuhedet": "מאוחדת", "מאוחדת": "מאוחדת",
-                    "clalit": "כללית", "כללית": "כללית"
-                }
-                user_info["hmo"] = hmo_mapping.get(user_info["hmo"].lower(), user_info["hmo"])
+                user_info["hmo"] = HMO_MAP.get(user_info["hmo"].lower(), user_info["hmo"])
             
             if "insurance_tier" in user_info:
-                tier_mapping = {
-                    "bronze": "ארד", "ארד": "ארד",
-                    "silver": "כסף", "כסף": "כסף",
-                    "gold": "זהב", "זהב": "זהב"
-                }
-                user_info["insurance_tier"] = tier_mapping.get(user_info["insurance_tier"].lower(), user_info["insurance_tier"])
+                user_info["insurance_tier"] = TIER_MAP.get(user_info["insurance_tier"].lower(), user_info["insurance_tier"])
             
             fields_extracted = list(user_info.keys())
             logger.info(f"Successfully extracted fields: {fields_extracted}")
@@ -292,57 +521,41 @@ class AzureOpenAIService:
 
     def is_user_info_complete(self, user_info: Dict[str, Any]) -> bool:
         """Check if all required user information fields are present and valid."""
-        required_fields = ["first_name", "last_name", "id_number", "gender", "age", "hmo", "hmo_card_number", "insurance_tier"]
-        
-        has_all_fields = all(field in user_info for field in required_fields)
+        has_all_fields = all(field in user_info for field in REQUIRED_FIELDS)
         
         if has_all_fields:
             # ID number should be 9 digits
-            if not user_info["id_number"].isdigit() or len(user_info["id_number"]) != 9:
+            if not _is_nine_digits(user_info["id_number"]):
                 logger.warning(f"Invalid ID number: {user_info['id_number']}")
                 return False
             
             # Gender should be male/female
-            if user_info["gender"] not in ["male", "female"]:
+            if user_info["gender"] not in VALID_GENDERS:
                 logger.warning(f"Invalid gender: {user_info['gender']}")
                 return False
             
-            # Age should be numeric and reasonable
-            try:
-                age_int = int(user_info["age"])
-                if not (0 <= age_int <= 120):
-                    logger.warning(f"Invalid age: {user_info['age']}")
-                    return False
-            except (ValueError, TypeError):
-                # If age is a string that contains a number, this should work
-                if isinstance(user_info["age"], str) and user_info["age"].isdigit():
-                    age_int = int(user_info["age"])
-                    if 0 <= age_int <= 120:
-                        # Age is valid, continue with validation
-                        pass
-                    else:
-                        logger.warning(f"Invalid age: {user_info['age']}")
-                        return False
-                else:
-                    logger.warning(f"Invalid age: {user_info['age']}")
-                    return False
+            # Age should be numeric and reasonable; it may arrive as an int or a numeric string
+            age = str(user_info["age"])
+            if not age.isdecimal() or not (0 <= int(age) <= 120):
+                logger.warning(f"Invalid age: {user_info['age']}")
+                return False
             
             # HMO should be one of the valid options
-            if user_info["hmo"] not in ["מכבי", "מאוחדת", "כללית"]:
+            if user_info["hmo"] not in VALID_HMOS:
                 logger.warning(f"Invalid HMO: {user_info['hmo']}")
                 return False
             
-            # HMO card number should be numeric
-            if not user_info["hmo_card_number"].isdigit():
+            # HMO card number should be 9 digits
+            if not _is_nine_digits(user_info["hmo_card_number"]):
                 logger.warning(f"Invalid HMO card number: {user_info['hmo_card_number']}")
                 return False
             
             # Insurance tier should be valid
-            if user_info["insurance_tier"] not in ["ארד", "כסף", "זהב"]:
+            if user_info["insurance_tier"] not in VALID_TIERS:
                 logger.warning(f"Invalid insurance tier: {user_info['insurance_tier']}")
                 return False
         else:
-            missing_fields = [f for f in required_fields if f not in user_info]
+            missing_fields = [f for f in REQUIRED_FIELDS if f not in user_info]
             logger.warning(f"Missing required fields: {missing_fields}")
         
         return has_all_fields
@@ -353,7 +566,7 @@ class AzureOpenAIService:
         This is used for UI messages without hardcoding translations.
         """
         try:
-            response = self.client.chat.completions.create(
+            response = await self.client.chat.completions.create(
                 model=self.info_deployment, 
                 messages=messages,
                 temperature=0.7,  
@@ -370,13 +583,7 @@ class AzureOpenAIService:
         except Exception as e:
             logger.error(f"Error in get_system_message: {str(e)}")
             return "An error occurred" if language == "en" else "אירעה שגיאה"
-    
-    
-_service_instance = None
 
-def get_openai_service():
-    """Get or create the Azure OpenAI service instance."""
-    global _service_instance
-    if _service_instance is None:
-        _service_instance = AzureOpenAIService()
-    return _service_instance
\ No newline at end of file
+    async def close(self):
+        """Close the underlying HTTP client and its pooled connections."""
+        await self.client.close()
@@ -0,0 +1,84 @@
+"""
+Response cache for Q&A answers.
+
+Only a conversation's first question is cached, and it is answered from the question alone: the Q&A
+system prompt carries no personal details, so such an answer depends only on the HMO, insurance tier,
+language and question, and can be reused for any user asking the same. Follow-up questions, which
+depend on the conversation before them, are never cached.
+Exact hits are keyed by a hash of the HMO, insurance tier, language and normalized question.
+When an embeddings deployment is configured, a semantic layer also matches rephrased
+questions whose embedding is close enough to a recently answered one in the same scope.
+"""
+import hashlib
+import logging
+import time
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+import numpy as np
+from cachetools import TTLCache
+
+logger = logging.getLogger(__name__)
+
+Scope = Tuple[str, str, str]
+
+def _plain(value: Any) -> str:
+    # HMO and tier arrive as str Enums from the request model
+    return str(getattr(value, "value", value))
+
+def normalize_question(question: str) -> str:
+    return " ".join(question.casefold().split())
+
+class ResponseCache:
+    def __init__(
+        self,
+        maxsize: int = 1000,
+        ttl: float = 900,
+        similarity_threshold: float = 0.95,
+        max_similar_per_scope: int = 256
+    ):
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self._exact = TTLCache(maxsize=maxsize, ttl=ttl)
+        # per scope: (expiry, unit-length embedding, answer), oldest first
+        self._similar: Dict[Scope, Deque[Tuple[float, np.ndarray, str]]] = defaultdict(
+            lambda: deque(maxlen=max_similar_per_scope)
+        )
+
+    @staticmethod
+    def scope(hmo: Any, tier: Any, language: str) -> Scope:
+        return (_plain(hmo), _plain(tier), language)
+
+    @staticmethod
+    def make_key(scope: Scope, question: str) -> str:
+        raw = "|".join((*scope, normalize_question(question)))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        return self._exact.get(key)
+
+    def set(self, key: str, answer: str) -> None:
+        self._exact[key] = answer
+
+    def get_similar(self, scope: Scope, embedding: np.ndarray) -> Optional[str]:
+        entries = self._similar.get(scope)
+        if not entries:
+            return None
+
+        now = time.monotonic()
+        while entries and entries[0][0] < now:
+            entries.popleft()
+        if not entries:
+            return None
+
+        # embeddings are stored unit-length, so the dot product is the cosine similarity
+        similarities = np.stack([vector for _, vector, _ in entries]) @ embedding
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity_threshold:
+            return None
+
+        logger.debug("Semantic cache hit with similarity %.3f", similarities[best])
+        return entries[best][2]
+
+    def add_similar(self, scope: Scope, embedding: np.ndarray, answer: str) -> None:
+        self._similar[scope].append((time.monotonic() + self.ttl, embedding, answer))
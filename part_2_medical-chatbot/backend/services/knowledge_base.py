@@ -1,56 +1,165 @@
 import os
+import asyncio
 import logging
-from bs4 import BeautifulSoup
-from typing import Dict, List, Optional
-import glob
+import pickle
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from lxml import etree
+from typing import Dict, List, Optional, Tuple
+from enum import Enum
+from functools import lru_cache
+from types import MappingProxyType
 
-from backend.config import settings,  RAW_COMBINED_HTML_PATH, KNOWLEDGE_BASE_DIR
+from backend.config import settings,  RAW_COMBINED_HTML_PATH, KNOWLEDGE_BASE_DIR, EMBEDDINGS_DIR
+from backend.services.retrieval import Embedder, KnowledgeIndex
 
 logger = logging.getLogger(__name__)
 
+# knowledge base files are named after the HMO in English
+_HMO_FILE_NAMES = frozenset(('maccabi', 'meuhedet', 'clalit'))
+_HMO_MAPPING = MappingProxyType({
+    'מכבי': 'maccabi',
+    'מאוחדת': 'meuhedet',
+    'כללית': 'clalit'
+})
+
+def _html_to_text(html_content: bytes) -> str:
+    """The page's text nodes, stripped and one per line, as BeautifulSoup's get_text('\\n', strip=True) returns them."""
+    # libxml2 decodes the raw bytes itself, so there's no separate decode pass and no encoding sniffing;
+    # a parser per call, since one shared between the loader threads would serialize them on its lock
+    root = etree.HTML(html_content, etree.HTMLParser(encoding='utf-8'))
+    if root is None:
+        return ''
+    
+    # walks the libxml2 tree directly instead of building a Python object per node first
+    etree.strip_elements(root, 'script', 'style', etree.Comment, with_tail=False)
+    return '\n'.join(text for text in (node.strip() for node in root.itertext()) if text)
+
 class KnowledgeBaseService:
     def __init__(self):
-        self.knowledge_base_dir = str(KNOWLEDGE_BASE_DIR)
+        self.knowledge_base_dir = KNOWLEDGE_BASE_DIR
+        # the parsed text of every file, so later starts skip HTML parsing while the files are unchanged
+        self.cache_path = self.knowledge_base_dir / '.kb_cache.pkl'
         self.hmo_data = {}
-        self._load_knowledge_base()
+        self._kb_cache: Dict[Tuple[str, str], str] = {}
+        self.indexes: Dict[str, KnowledgeIndex] = {}
+        self.preload_all()
         logger.info("Knowledge base service initialized successfully")
     
-    def _load_knowledge_base(self):
+    def preload_all(self):
         """Load and parse all HTML files in the knowledge base directory."""
         try:
-            html_files = glob.glob(os.path.join(self.knowledge_base_dir, "*.html"))
+            with os.scandir(self.knowledge_base_dir) as entries:
+                html_entries = [entry for entry in entries if entry.is_file(follow_symlinks=False) and entry.name.endswith('.html')]
             
-            if not html_files:
-                logger.warning(f"No HTML files found in {self.knowledge_base_dir}")
+            if not html_entries:
+                logger.warning("No HTML files found in %s", self.knowledge_base_dir)
                 return
             
-            for file_path in html_files:
-                try:
-                    file_name = os.path.basename(file_path)
-                    hmo_name = file_name.split('.')[0]  
-                    
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        html_content = f.read()
-                    
-                    soup = BeautifulSoup(html_content, 'html.parser')
-                    
-                    text_content = soup.get_text(separator='\n', strip=True)
-                    
-                    self.hmo_data[hmo_name] = {
-                        'text': text_content,
-                        'html': html_content
-                    }
-                    logger.info(f"Loaded knowledge base file: {file_name}")
-                    
-                except Exception as e:
-                    logger.error(f"Error loading knowledge base file {file_path}: {str(e)}")
-            
-            logger.info(f"Loaded {len(self.hmo_data)} knowledge base files")
+            html_files = [entry.path for entry in html_entries]
+            cached = self._read_cache(html_files, max(entry.stat().st_mtime for entry in html_entries))
+            if cached is not None:
+                # unpickled keys are fresh strings; intern them like freshly parsed ones
+                self.hmo_data = {sys.intern(name): data for name, data in cached.items()}
+                logger.info("Loaded %d knowledge base files from %s", len(self.hmo_data), self.cache_path)
+            else:
+                # libxml2 releases the GIL while parsing, so the files load in parallel
+                with ThreadPoolExecutor(max_workers=min(8, len(html_files))) as executor:
+                    results = list(executor.map(self._load_file, html_entries))
+                
+                self.hmo_data = dict(result for result in results if result is not None)
+                self._write_cache()
+                
+                logger.info("Loaded %d knowledge base files", len(self.hmo_data))
+            self._index_aliases()
             
         except Exception as e:
-            logger.error(f"Error loading knowledge base: {str(e)}")
+            logger.error("Error loading knowledge base: %s", e)
             raise
     
+    def _read_cache(self, html_files: List[str], newest_mtime: float) -> Optional[Dict[str, Dict[str, str]]]:
+        """The parsed knowledge base saved by an earlier start, if it is newer than every HTML file and covers exactly them."""
+        try:
+            if os.stat(self.cache_path).st_mtime < newest_mtime:
+                return None
+            with open(self.cache_path, 'rb') as f:
+                hmo_data = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("Ignoring unreadable knowledge base cache %s: %s", self.cache_path, e)
+            return None
+        
+        if sorted(data['path'] for data in hmo_data.values()) != sorted(html_files):
+            return None
+        return hmo_data
+    
+    def _write_cache(self):
+        # written to a temporary file and renamed, so a worker starting at the same time never reads half a file
+        temp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                pickle.dump(self.hmo_data, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self.cache_path)
+        except OSError as e:
+            # parsing again on the next start is slower, not wrong
+            logger.warning("Could not write knowledge base cache %s: %s", self.cache_path, e)
+    
+    def _load_file(self, entry: os.DirEntry) -> Optional[Tuple[str, Dict[str, str]]]:
+        """Read and parse one knowledge base file, returning (hmo_name, data) or None if it could not be loaded."""
+        # the directory entry already carries the name and full path, so no path string is rebuilt here
+        file_name = entry.name
+        file_path = entry.path
+        try:
+            hmo_name = sys.intern(file_name.split('.')[0])
+            
+            with open(file_path, 'rb') as f:
+                html_content = f.read()
+            
+            text_content = _html_to_text(html_content)
+            
+            logger.info("Loaded knowledge base file: %s", file_name)
+            # only the parsed text stays in memory; the rarely used raw HTML is re-read from disk on demand
+            return hmo_name, {
+                'text': text_content,
+                'path': file_path
+            }
+            
+        except Exception as e:
+            logger.error("Error loading knowledge base file %s: %s", file_path, e)
+            return None
+    
+    def _index_aliases(self):
+        """Index each HMO's content under every name a request may use for it, Hebrew or English."""
+        self._kb_cache = {}
+        for name in [*self.hmo_data, *_HMO_MAPPING]:
+            normalized_hmo = self._normalize_hmo_name(name)
+            if normalized_hmo in self.hmo_data:
+                self._kb_cache[(name, 'text')] = self.hmo_data[normalized_hmo]['text']
+    
+    async def build_indexes(self, embed: Embedder, model: str):
+        """Embed every HMO's knowledge base so questions can be answered from the relevant chunks only."""
+        names = list(self.hmo_data)
+        results = await asyncio.gather(
+            *(KnowledgeIndex.build(name, self.hmo_data[name]['text'], embed, model, EMBEDDINGS_DIR) for name in names),
+            return_exceptions=True
+        )
+        
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                # that HMO keeps getting its full knowledge base in the prompt
+                logger.warning("Could not build the retrieval index for %s: %s", name, result)
+            else:
+                self.indexes[name] = result
+        
+        logger.info("Built retrieval indexes for %d of %d HMOs", len(self.indexes), len(names))
+    
+    def get_index(self, hmo_name: str) -> Optional[KnowledgeIndex]:
+        """The retrieval index for an HMO, or None when it has none and the full text should be used."""
+        if isinstance(hmo_name, Enum):
+            hmo_name = hmo_name.value
+        return self.indexes.get(self._normalize_hmo_name(hmo_name))
+    
     def get_knowledge_for_hmo(self, hmo_name: str, format_type: str = 'text') -> Optional[str]:
         """
         Get knowledge base content for a specific HMO.
@@ -62,30 +171,38 @@ class KnowledgeBaseService:
         Returns:
             Knowledge base content or None if not found
         """
+        # plain str keys hash and compare faster than Enum members
+        if isinstance(hmo_name, Enum):
+            hmo_name = hmo_name.value
+        
+        # the common case: an exact name preloaded by _index_aliases
+        content = self._kb_cache.get((hmo_name, format_type))
+        if content is not None:
+            return content
+        
+        entry = self.hmo_data.get(self._normalize_hmo_name(hmo_name))
+        if entry is None:
+            logger.warning("No knowledge base data found for HMO: %s", hmo_name)
+            return None
+        
+        if format_type != 'html':
+            return entry['text']
+        
+        # reading the file is the only step here that can fail
         try:
-            normalized_hmo = self._normalize_hmo_name(hmo_name)
-            
-            if normalized_hmo not in self.hmo_data:
-                logger.warning(f"No knowledge base data found for HMO: {hmo_name}")
-                return None
-            
-            if format_type == 'html':
-                return self.hmo_data[normalized_hmo]['html']
-            else:
-                return self.hmo_data[normalized_hmo]['text']
-                
-        except Exception as e:
-            logger.error(f"Error getting knowledge for HMO {hmo_name}: {str(e)}")
+            with open(entry['path'], 'r', encoding='utf-8') as f:
+                return f.read()
+        except OSError as e:
+            logger.error("Error reading knowledge base HTML for HMO %s: %s", hmo_name, e)
             return None
     
-    def _normalize_hmo_name(self, hmo_name: str) -> str:
-        hmo_mapping = {
-            'מכבי': 'maccabi',
-            'מאוחדת': 'meuhedet',
-            'כללית': 'clalit'
-        }
-        
-        if hmo_name.lower() in ['maccabi', 'meuhedet', 'clalit']:
-            return hmo_name.lower()
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def _normalize_hmo_name(hmo_name: str) -> str:
+        # only a handful of spellings ever reach this, so each is normalized once
+        # interned like the hmo_data keys, so the lookups that follow match on identity
+        lowered = sys.intern(hmo_name.lower())
+        if lowered in _HMO_FILE_NAMES:
+            return lowered
         
-        return hmo_mapping.get(hmo_name, hmo_name.lower())
\ No newline at end of file
+        return sys.intern(_HMO_MAPPING.get(hmo_name, lowered))
\ No newline at end of file
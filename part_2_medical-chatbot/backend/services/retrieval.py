@@ -0,0 +1,122 @@
+"""
+Retrieval over the HMO knowledge bases.
+
+Each HMO's text is split into small overlapping chunks of whole lines and embedded once at startup,
+so a question is answered with only the chunks closest to it instead of the whole knowledge base.
+Embeddings are kept as int8 and saved next to the knowledge base, to be reused across restarts while its text is unchanged.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+from pathlib import Path
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+import numpy as np
+
+from backend.utils.helpers import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# the knowledge bases are a few thousand tokens per HMO, made of short per-service tables,
+# so small chunks keep a retrieved chunk to roughly one service
+CHUNK_TOKENS = 100
+CHUNK_OVERLAP_TOKENS = 15
+TOP_K = 6
+
+Embedder = Callable[[List[str]], Awaitable[np.ndarray]]
+
+def chunk_text(text: str, max_tokens: int = CHUNK_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> List[str]:
+    """Pack whole lines into chunks of at most max_tokens, repeating up to overlap_tokens of lines between neighbours."""
+    chunks = []
+    window: List[Tuple[str, int]] = []
+    size = 0
+    carried = 0
+
+    for line in text.splitlines():
+        tokens = count_tokens(line)
+        if len(window) > carried and size + tokens > max_tokens:
+            chunks.append("\n".join(line for line, _ in window))
+
+            # carry the tail of the chunk over, so a fact on the boundary keeps its heading
+            tail = []
+            size = 0
+            for entry in reversed(window):
+                if size + entry[1] > overlap_tokens:
+                    break
+                tail.append(entry)
+                size += entry[1]
+            window = tail[::-1]
+            carried = len(window)
+
+        window.append((line, tokens))
+        size += tokens
+
+    if len(window) > carried:
+        chunks.append("\n".join(line for line, _ in window))
+    return chunks
+
+def quantize(vectors: np.ndarray) -> np.ndarray:
+    """Scale unit-length float vectors to int8, a quarter of the memory for a negligible loss in ranking accuracy."""
+    if vectors.dtype == np.int8:
+        return vectors
+    return np.clip(np.round(vectors * 127), -128, 127).astype(np.int8)
+
+class KnowledgeIndex:
+    def __init__(self, chunks: List[str], vectors: np.ndarray):
+        self.chunks = chunks
+        # one int8-quantized unit-length row per chunk, so a dot product ranks chunks by cosine similarity
+        self.vectors = quantize(vectors)
+
+    def search(self, embedding: np.ndarray, top_k: int = TOP_K) -> str:
+        """Return the top_k chunks closest to the (unit-length) embedding, joined in document order."""
+        if top_k >= len(self.chunks):
+            return "\n\n".join(self.chunks)
+
+        # an exact scan: with tens of chunks per HMO this is a single small matrix-vector product.
+        # the question stays in float32, which keeps the ranking closer to the unquantized one
+        # (and, unlike int8 @ int8, cannot overflow); the results are cosines scaled by 127
+        similarities = self.vectors @ embedding
+        best = np.sort(np.argpartition(similarities, -top_k)[-top_k:])
+        return "\n\n".join(self.chunks[i] for i in best)
+
+    @classmethod
+    async def build(cls, name: str, text: str, embed: Embedder, model: str, cache_dir: Path) -> "KnowledgeIndex":
+        # tokenizing the whole knowledge base (and loading the tokenizer, which may download it the first time)
+        # and the file access would otherwise block the event loop, and /health with it, during startup
+        chunks = await asyncio.to_thread(chunk_text, text)
+        fingerprint = hashlib.sha256("\0".join([model, *chunks]).encode("utf-8")).hexdigest()
+        path = cache_dir / f"{name}.npz"
+
+        vectors = await asyncio.to_thread(_load_vectors, path, fingerprint)
+        if vectors is None:
+            vectors = quantize(await embed(chunks))
+            await asyncio.to_thread(_save_vectors, path, fingerprint, vectors)
+            logger.info("Embedded %d knowledge base chunks for %s", len(chunks), name)
+        else:
+            logger.info("Loaded %d knowledge base embeddings for %s from %s", len(chunks), name, path)
+
+        return cls(chunks, vectors)
+
+def _load_vectors(path: Path, fingerprint: str) -> Optional[np.ndarray]:
+    try:
+        with np.load(path) as saved:
+            if str(saved["fingerprint"]) == fingerprint:
+                return saved["vectors"]
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable embeddings file {path}: {str(e)}")
+    return None
+
+def _save_vectors(path: Path, fingerprint: str, vectors: np.ndarray):
+    # written to a temporary file and renamed, so a worker loading it at the same time never reads half a file
+    temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(temp_path, "wb") as f:
+            np.savez(f, fingerprint=np.array(fingerprint), vectors=vectors)
+        os.replace(temp_path, path)
+    except OSError as e:
+        # the index still works, it is just rebuilt on the next start
+        logger.warning(f"Could not save embeddings to {path}: {str(e)}")
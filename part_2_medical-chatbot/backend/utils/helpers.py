@@ -1,27 +1,102 @@
 import logging
 import json
-from typing import Dict, List, Any, Optional
+from functools import lru_cache
+from typing import Dict, Iterable, List, Any, Optional
 import re 
 
+import tiktoken
+
 logger = logging.getLogger(__name__)
 
+_SCRIPT_OPEN_RE = re.compile(r'<script\b', re.IGNORECASE)
+_SCRIPT_CLOSE_RE = re.compile(r'</script>', re.IGNORECASE)
+_HEBREW_RE = re.compile(r'[\u0590-\u05FF]') ## acording to my ASCII table
+
+_JSON_DECODER = json.JSONDecoder()
+# every field in one scan of the text. The alternatives are lookaheads, so overlapping fields
+# (the "card number" inside an "HMO card number: ..." line) are all still found
+_USER_INFO_RE = re.compile(
+    r'(?=name:?\s*(?P<name>[^\n]+))|'
+    r'(?=id(?:\s*number)?:?\s*(?P<id>\d{9}))|'
+    r'(?=gender:?\s*(?P<gender>\w+))|'
+    r'(?=age:?\s*(?P<age>\d+))|'
+    r'(?=hmo:?\s*(?P<hmo>[^\n]+))|'
+    r'(?=card(?:\s*number)?:?\s*(?P<card>\d{9}))|'
+    r'(?=tier:?\s*(?P<tier>[^\n]+))',
+    re.IGNORECASE
+)
+_USER_INFO_GROUPS = len(_USER_INFO_RE.groupindex)
+
+# Both strippers remove the same spans the regexes <script\b[^<]*(?:(?!</script>)<[^<]*)*</script>
+# and <[^>]*> did, but in a single forward scan: once an opening has no closing after it,
+# no later opening can have one either, so they stop there instead of rescanning to the end
+# from every remaining '<' (quadratic on input such as a long run of unclosed '<').
+
+def _strip_scripts(text: str) -> str:
+    parts = []
+    pos = 0
+    while True:
+        opening = _SCRIPT_OPEN_RE.search(text, pos)
+        if opening is None:
+            break
+        closing = _SCRIPT_CLOSE_RE.search(text, opening.end())
+        if closing is None:
+            break
+        parts.append(text[pos:opening.start()])
+        pos = closing.end()
+    parts.append(text[pos:])
+    return ''.join(parts)
+
+def _strip_tags(text: str) -> str:
+    parts = []
+    pos = 0
+    while True:
+        start = text.find('<', pos)
+        if start < 0:
+            break
+        end = text.find('>', start + 1)
+        if end < 0:
+            break
+        parts.append(text[pos:start])
+        pos = end + 1
+    parts.append(text[pos:])
+    return ''.join(parts)
+
 def sanitize_input(text: str) -> str:
     if not text:
         return ""
     
-    text = re.sub(r'<[^>]*>', '', text) 
-    text = re.sub(r'<script\b[^<]*(?:(?!<\/script>)<[^<]*)*<\/script>', '', text)
+    # most chat messages contain no markup at all
+    if '<' not in text:
+        return text.strip()
+    
+    # whole script blocks go first; once their tags are stripped their content can no longer be found
+    text = _strip_scripts(text)
+    text = _strip_tags(text) 
     text = text.strip()
     
     return text
 
 def detect_language(text: str) -> str:
-    hebrew_pattern = re.compile(r'[\u0590-\u05FF]') ## acording to my ASCII table
-    if hebrew_pattern.search(text):
+    # English messages are the common case, and isascii is a single C-level pass
+    if not text.isascii() and _HEBREW_RE.search(text):
         return 'he'
     else:
         return 'en'
 
+@lru_cache(maxsize=1)
+def _get_encoding():
+    # o200k_base is the tokenizer of the gpt-4o family the deployments run
+    return tiktoken.get_encoding("o200k_base")
+
+def count_tokens(text: str) -> int:
+    return len(_get_encoding().encode(text))
+
+def count_message_tokens(messages: Iterable[Dict[str, str]]) -> int:
+    encoding = _get_encoding()
+    # each chat message carries a few tokens of role/separator framing on top of its content
+    return sum(len(encoding.encode(message["content"])) + 4 for message in messages)
+
 def format_error_response(error_message: str, status_code: int = 400) -> Dict[str, Any]:
     return {
         "status": "error",
@@ -34,32 +109,36 @@ def extract_user_info_from_llm_response(response_text: str) -> Optional[Dict[str
     ## because different browsers might handle regex and JSON parsing slightly differently
     ## and also for security reasons 
     try:
-        import re
-        json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-        if json_match:
+        # decode the object that starts at the first brace and stop where it ends,
+        # rather than matching up to the last brace and parsing that substring again
+        start = response_text.find('{')
+        if start >= 0:
             try:
-                json_str = json_match.group(0)
-                return json.loads(json_str)
+                return _JSON_DECODER.raw_decode(response_text, start)[0]
             except json.JSONDecodeError:
                 pass
         
+        # the first occurrence of each field, as a separate search per field would find it
+        found = {}
+        for match in _USER_INFO_RE.finditer(response_text):
+            found.setdefault(match.lastgroup, match.group(match.lastgroup))
+            if len(found) == _USER_INFO_GROUPS:
+                break
+        
         info = {}
         
-        name_match = re.search(r'name:?\s*([^\n]+)', response_text, re.IGNORECASE)
-        if name_match:
-            full_name = name_match.group(1).strip()
+        if 'name' in found:
+            full_name = found['name'].strip()
             name_parts = full_name.split()
             if len(name_parts) >= 2:
                 info['first_name'] = name_parts[0]
                 info['last_name'] = ' '.join(name_parts[1:])
         
-        id_match = re.search(r'id(?:\s*number)?:?\s*(\d{9})', response_text, re.IGNORECASE)
-        if id_match:
-            info['id_number'] = id_match.group(1)
+        if 'id' in found:
+            info['id_number'] = found['id']
         
-        gender_match = re.search(r'gender:?\s*(\w+)', response_text, re.IGNORECASE)
-        if gender_match:
-            gender = gender_match.group(1).lower()
+        if 'gender' in found:
+            gender = found['gender'].lower()
             if gender in ['male', 'זכר']:
                 info['gender'] = 'male'
             elif gender in ['female', 'נקבה']:
@@ -67,22 +146,18 @@ def extract_user_info_from_llm_response(response_text: str) -> Optional[Dict[str
             else:
                 info['gender'] = 'other'
         
-        age_match = re.search(r'age:?\s*(\d+)', response_text, re.IGNORECASE)
-        if age_match:
-            info['age'] = int(age_match.group(1))
+        if 'age' in found:
+            info['age'] = int(found['age'])
         
-        hmo_match = re.search(r'hmo:?\s*([^\n]+)', response_text, re.IGNORECASE)
-        if hmo_match:
-            hmo = hmo_match.group(1).strip()
+        if 'hmo' in found:
+            hmo = found['hmo'].strip()
             info['hmo'] = hmo
         
-        card_match = re.search(r'card(?:\s*number)?:?\s*(\d{9})', response_text, re.IGNORECASE)
-        if card_match:
-            info['hmo_card_number'] = card_match.group(1)
+        if 'card' in found:
+            info['hmo_card_number'] = found['card']
         
-        tier_match = re.search(r'tier:?\s*([^\n]+)', response_text, re.IGNORECASE)
-        if tier_match:
-            tier = tier_match.group(1).strip()
+        if 'tier' in found:
+            tier = found['tier'].strip()
             info['insurance_tier'] = tier
         
         required_fields = ['first_name', 'last_name', 'id_number', 'gender', 'age', 'hmo', 'hmo_card_number', 'insurance_tier']
@@ -1,17 +1,33 @@
 import os
 import sys
+import atexit
+import queue
 import logging
 from datetime import datetime
-from logging.handlers import RotatingFileHandler
-import json
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import orjson
 
 from backend.config import settings
 
-def setup_logging():    
+_file_listener = None
+
+@atexit.register
+def _stop_file_listener():
+    # writes out whatever is still queued before the process exits
+    global _file_listener
+    if _file_listener is not None:
+        _file_listener.stop()
+        _file_listener = None
+
+def setup_logging(per_process: bool = False):
+    global _file_listener
+    
     os.makedirs(settings.LOG_DIR, exist_ok=True)
     
     current_date = datetime.now().strftime("%Y-%m-%d")
-    log_file = os.path.join(settings.LOG_DIR, f"medical_chatbot_{current_date}.log")
+    # a rotating file must have a single writer, so each of several worker processes gets its own
+    suffix = f"_{os.getpid()}" if per_process else ""
+    log_file = os.path.join(settings.LOG_DIR, f"medical_chatbot_{current_date}{suffix}.log")
     
     logger = logging.getLogger()
     logger.setLevel(getattr(logging, settings.LOG_LEVEL))
@@ -24,14 +40,17 @@ def setup_logging():
     file_handler = RotatingFileHandler(
         log_file, 
         maxBytes=10485760,  # 10MB
-        backupCount=10
+        backupCount=10,
+        # orjson writes Hebrew messages as UTF-8 rather than as \u escapes
+        encoding="utf-8"
     )
     file_handler.setLevel(getattr(logging, settings.LOG_LEVEL))
     
     class JsonFormatter(logging.Formatter):
         def format(self, record):
             log_record = {
-                "timestamp": datetime.now().isoformat(),
+                # the creation time logging already stamped on the record, rather than another clock read per line
+                "timestamp": f"{self.formatTime(record, '%Y-%m-%dT%H:%M:%S')}.{int(record.msecs):03d}",
                 "level": record.levelname,
                 "message": record.getMessage(),
                 "module": record.module,
@@ -42,14 +61,22 @@ def setup_logging():
             if record.exc_info:
                 log_record["exception"] = self.formatException(record.exc_info)
                 
-            return json.dumps(log_record)
+            return orjson.dumps(log_record).decode()
     
     console_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     console_handler.setFormatter(console_formatter)
     
-    file_handler.setFormatter(JsonFormatter())
+    # the record is rendered to its JSON line when queued; the listener thread does the writing and rotating,
+    # so a request never waits on the log file
+    queue_handler = QueueHandler(queue.Queue(-1))
+    queue_handler.setLevel(getattr(logging, settings.LOG_LEVEL))
+    queue_handler.setFormatter(JsonFormatter())
+    
+    _stop_file_listener()
+    _file_listener = QueueListener(queue_handler.queue, file_handler)
+    _file_listener.start()
     
     logger.addHandler(console_handler)
-    logger.addHandler(file_handler)
+    logger.addHandler(queue_handler)
     
     return logger
\ No newline at end of file
@@ -1,6 +1,9 @@
 import os
-from bs4 import BeautifulSoup
+import html
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from lxml import etree
+from typing import Dict, List, Optional
 import logging
 
 # Setup logging
@@ -15,7 +18,89 @@ HMO_NAME_MAPPING = {
     "כללית": "clalit"
 }
 
-def preprocess_hmo_html(input_dir: str, output_dir: str):
+def _text(element) -> str:
+    # each text node stripped and concatenated, like BeautifulSoup's get_text(strip=True)
+    return "".join(text.strip() for text in element.itertext())
+
+def _inner_html(element) -> str:
+    # the element's children serialized without its own tag, like BeautifulSoup's decode_contents()
+    parts = [html.escape(element.text, quote=False)] if element.text else []
+    parts.extend(etree.tostring(child, encoding="unicode", method="html") for child in element)
+    return "".join(parts)
+
+def _process_file(filepath: str) -> Optional[Dict[str, List[str]]]:
+    """Extract one raw service page into its sections per HMO, or None if it could not be processed."""
+    filename = os.path.basename(filepath)
+    logger.info("Processing file: %s", filename)
+
+    hmo_data = {hmo: [] for hmo in HMOS_HEBREW}
+    # each HMO's list, in the order of its column after the service name, looked up once per file
+    hmo_buckets = list(hmo_data.values())
+    try:
+        # libxml2 reads and parses the file in C; the raw pages are fragments, which it wraps in <html><body>
+        tree = etree.parse(filepath, etree.HTMLParser(encoding="utf-8"))
+
+        section_title = filename.replace(".html", "").replace("_", " ")
+        section_slug = section_title.lower().replace(' ', '-')
+        logger.info("Extracted section title: %s", section_title)
+
+        tables = tree.xpath('//table')
+        logger.info("Found %d tables in %s", len(tables), filename)
+
+        for table_idx, table in enumerate(tables):
+            # one walk over the table's rows: the first is the header, the rest are services
+            tr_iter = table.iter('tr')
+            header = next(tr_iter, None)
+            if header is None:
+                continue
+            
+            columns = [_text(th) for th in header.iter('th')]
+            logger.info("Table %d columns: %s", table_idx + 1, columns)
+            
+            if len(columns) < 4:
+                logger.warning("Table %d has fewer than 4 columns, skipping", table_idx + 1)
+                continue
+            
+            row_idx = -1
+            for row_idx, row in enumerate(tr_iter):
+                cells = row.findall('.//td')
+                if len(cells) < 4:
+                    continue
+                
+                service_name = _text(cells[0])
+                # the same for every HMO column of the row, so built once here
+                section_id = f"{section_slug}-{service_name.lower().replace(' ', '-')}"
+                heading = f"{section_title} - {service_name}"
+                
+                # Extract relevant HMO data
+                for bucket, cell in zip(hmo_buckets, cells[1:4]):
+                    benefit_html = _inner_html(cell)
+                    
+                    formatted_section = f"""
+                    <div class="service-section" id="{section_id}">
+                        <h3>{heading}</h3>
+                        <div class="benefit-details">
+                            {benefit_html}
+                        </div>
+                    </div>
+                    """
+                    
+                    bucket.append(formatted_section)
+                
+                if row_idx < 3 and logger.isEnabledFor(logging.DEBUG):  # Log the first few rows as samples
+                    logger.debug("Processed service: %s", service_name)
+            
+            # the rows are only counted as they are walked
+            logger.info("Processed %d rows from table %d", row_idx + 1, table_idx + 1)
+
+        # only HMOs with services get a knowledge base file
+        return {hmo: sections for hmo, sections in hmo_data.items() if sections}
+        
+    except Exception as e:
+        logger.error("Error processing %s: %s", filename, e)
+        return None
+
+def preprocess_hmo_html(input_dir: str, output_dir: str, filenames: Optional[List[str]] = None):
     """
     Preprocess multiple HTML files containing HMO service tables.
     Aggregates services per HMO into combined HTML files.
@@ -23,80 +108,33 @@ def preprocess_hmo_html(input_dir: str, output_dir: str):
     Args:
         input_dir: Directory containing the raw service HTML files
         output_dir: Directory to save the per-HMO combined HTML files
+        filenames: Names of the files in input_dir to process, if the caller already listed it
     """
     os.makedirs(output_dir, exist_ok=True)
 
+    if filenames is not None:
+        filepaths = [os.path.join(input_dir, filename) for filename in filenames if filename.endswith(".html")]
+    else:
+        # the directory entries carry their type and full path, so nothing is stat-ed or joined again
+        with os.scandir(input_dir) as entries:
+            filepaths = [entry.path for entry in entries if entry.is_file() and entry.name.endswith(".html")]
+
     hmo_data = defaultdict(list)
     processed_files = 0
     processed_services = 0
 
-    for filename in os.listdir(input_dir):
-        if not filename.endswith(".html"):
-            continue
-        filepath = os.path.join(input_dir, filename)
-        
-        logger.info(f"Processing file: {filename}")
-
-        try:
-            with open(filepath, "r", encoding="utf-8") as f:
-                html_content = f.read()
-
-            soup = BeautifulSoup(html_content, "html.parser")
-
-            section_title = filename.replace(".html", "").replace("_", " ")
-            logger.info(f"Extracted section title: {section_title}")
-
-            tables = soup.find_all('table')
-            logger.info(f"Found {len(tables)} tables in {filename}")
-
-            for table_idx, table in enumerate(tables):
-                header = table.find('tr')
-                if not header:
+    if filepaths:
+        # the files are independent and libxml2 releases the GIL while parsing, so they are processed in threads,
+        # like the knowledge base loader does; forking here would copy the caller's threads' locks into the children.
+        # map keeps the input order, so the combined files come out the same as a sequential run
+        with ThreadPoolExecutor(max_workers=min(8, len(filepaths))) as executor:
+            for partial in executor.map(_process_file, filepaths):
+                if partial is None:
                     continue
-                
-                columns = [th.get_text(strip=True) for th in header.find_all('th')]
-                logger.info(f"Table {table_idx+1} columns: {columns}")
-                
-                if len(columns) < 4:
-                    logger.warning(f"Table {table_idx+1} has fewer than 4 columns, skipping")
-                    continue
-                
-                rows = table.find_all('tr')[1:]  # Skip header row
-                logger.info(f"Processing {len(rows)} rows from table {table_idx+1}")
-                
-                for row_idx, row in enumerate(rows):
-                    cells = row.find_all('td')
-                    if len(cells) < 4:
-                        continue
-                    
-                    service_name = cells[0].get_text(strip=True)
-                    
-                    # Extract relevant HMO data
-                    for i, hmo in enumerate(HMOS_HEBREW):
-                        if i + 1 >= len(cells):
-                            continue
-                            
-                        benefit_html = cells[i + 1].decode_contents()
-                        
-                        formatted_section = f"""
-                        <div class="service-section" id="{section_title.lower().replace(' ', '-')}-{service_name.lower().replace(' ', '-')}">
-                            <h3>{section_title} - {service_name}</h3>
-                            <div class="benefit-details">
-                                {benefit_html}
-                            </div>
-                        </div>
-                        """
-                        
-                        hmo_data[hmo].append(formatted_section)
-                        processed_services += 1
-                    
-                    if row_idx < 3:  # Log the first few rows as samples
-                        logger.info(f"Processed service: {service_name}")
-        
-            processed_files += 1
-            
-        except Exception as e:
-            logger.error(f"Error processing {filename}: {str(e)}")
+                for hmo, sections in partial.items():
+                    hmo_data[hmo].extend(sections)
+                    processed_services += len(sections)
+                processed_files += 1
 
     for hmo, sections in hmo_data.items():
         file_path = os.path.join(output_dir, f"{HMO_NAME_MAPPING[hmo]}.html")
@@ -119,7 +157,7 @@ def preprocess_hmo_html(input_dir: str, output_dir: str):
             </html>
             """)
         
-        logger.info(f"Created knowledge base file for {hmo} with {len(sections)} services")
+        logger.info("Created knowledge base file for %s with %d services", hmo, len(sections))
 
-    logger.info(f"Preprocessing complete. Processed {processed_files} files and {processed_services} services.")
+    logger.info("Preprocessing complete. Processed %d files and %d services.", processed_files, processed_services)
     return f"Preprocessing complete. Files saved to {output_dir}"
\ No newline at end of file
@@ -2,7 +2,9 @@ import streamlit as st
 import requests
 import os
 import re
-from typing import Dict, Any
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Iterator, Optional
 
 API_URL = os.getenv("API_URL", "http://localhost:8000")
 
@@ -15,6 +17,7 @@ st.set_page_config(
 # Initialization
 for key, default in [
     ("chat_history", []),
+    ("history_summary", {"summary": "", "summary_upto": 0, "qa_start": None}),
     ("user_info", None),
     ("language", "en"),
     ("information_phase_complete", False),
@@ -23,14 +26,14 @@ for key, default in [
         st.session_state[key] = default
 
 
-def call_chat_api(message: str) -> Dict[str, Any]:
+def build_chat_payload(message: str) -> Dict[str, Any]:
     payload = {
         "message": message,
         "language": st.session_state.language
     }
 
     if st.session_state.chat_history:
-        payload["chat_history"] = {"messages": st.session_state.chat_history}
+        payload["chat_history"] = {"messages": st.session_state.chat_history, **st.session_state.history_summary}
 
     if st.session_state.user_info and st.session_state.information_phase_complete:
         user_info = st.session_state.user_info
@@ -40,6 +43,21 @@ def call_chat_api(message: str) -> Dict[str, Any]:
         print("❌ No user_info in payload - still in information collection phase")
 
     print(f"🔍 API Request payload: {payload}")
+    return payload
+
+
+def remember_history_summary(updated_chat_history: Dict[str, Any]) -> None:
+    # the backend folds old turns into a summary and marks where the Q&A phase started;
+    # send both back so the summary isn't regenerated and later questions aren't taken for the first one
+    st.session_state.history_summary = {
+        "summary": updated_chat_history.get("summary", ""),
+        "summary_upto": updated_chat_history.get("summary_upto", 0),
+        "qa_start": updated_chat_history.get("qa_start"),
+    }
+
+
+def call_chat_api(message: str) -> Dict[str, Any]:
+    payload = build_chat_payload(message)
 
     response = requests.post(
         f"{API_URL}/api/chat/chat",
@@ -54,7 +72,42 @@ def call_chat_api(message: str) -> Dict[str, Any]:
         return {"error": error_msg}
 
     print(f"✅ API Response: {response.status_code}")
-    return response.json()
+    result = response.json()
+    remember_history_summary(result["updated_chat_history"])
+    return result
+
+
+def stream_chat_api(message: str) -> Iterator[str]:
+    """
+    Yield the assistant reply from the streaming chat endpoint as it is generated,
+    so the first words show up without waiting for the whole completion.
+    """
+    payload = build_chat_payload(message)
+
+    with requests.post(f"{API_URL}/api/chat/chat/stream", json=payload, stream=True) as response:
+        if response.status_code != 200:
+            error_msg = f"API Error: {response.status_code} - {response.text}"
+            print(f"❌ API ERROR: {error_msg}")
+            raise RuntimeError(error_msg)
+
+        # SSE responses don't declare a charset, and requests would otherwise assume latin-1
+        response.encoding = "utf-8"
+        event = None
+        for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+            if not line:
+                event = None
+            elif line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                data = json.loads(line[len("data: "):])
+                if event == "error":
+                    raise RuntimeError(data["detail"])
+                if event == "done":
+                    remember_history_summary(data["updated_chat_history"])
+                elif event is None:
+                    yield data["delta"]
+
+    print("✅ Streamed API response complete")
 
 
 def extract_user_info_api(text: str) -> Dict[str, Any]:
@@ -94,10 +147,10 @@ def extract_user_info_api(text: str) -> Dict[str, Any]:
 
 
 
-def process_information_directly(user_message: str) -> bool:
+def process_information_directly(user_message: str) -> Optional[str]:
     """
     A direct approach to process user information without relying on complex detection.
-    Returns True if successful, False otherwise.
+    Returns the welcome message for the Q&A phase if successful, None otherwise.
     """
     required_fields = ["name", "id", "gender", "age", "hmo", "card", "tier"]
     
@@ -108,26 +161,32 @@ def process_information_directly(user_message: str) -> bool:
     
     if not has_all_fields:
         print(f"❌ Message does not contain all required fields")
-        return False
+        return None
     
     try:
         print(f"🔍 Attempting direct information extraction...")
         
-        result = extract_user_info_api(user_message)
+        # the welcome message doesn't depend on the extracted details, so both backend
+        # calls run at the same time instead of one after the other
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            extraction = pool.submit(extract_user_info_api, user_message)
+            welcome = pool.submit(get_localized_system_message, "welcome", st.session_state.language)
+            result = extraction.result()
+            welcome_msg = welcome.result()
         
         if "error" in result or not result.get("is_complete", False):
             print(f"❌ Direct extraction failed: {result.get('error', 'Incomplete information')}")
-            return False
+            return None
             
         st.session_state.user_info = result["user_info"]
         st.session_state.information_phase_complete = True
         
         print(f"✅ DIRECT EXTRACTION SUCCESSFUL: {result['user_info']}")
-        return True
+        return welcome_msg
         
     except Exception as e:
         print(f"❌ Exception during direct information processing: {str(e)}")
-        return False
+        return None
 
 
 def check_and_process_from_assistant_response(message: str) -> bool:
@@ -268,25 +327,23 @@ def main():
         st.session_state.chat_history.append({"role": "user", "content": prompt})
 
         if not st.session_state.information_phase_complete:
-            if process_information_directly(prompt):
+            welcome_msg = process_information_directly(prompt)
+            if welcome_msg is not None:
                 # If successful, handle it as if we're in the Q&A phase
-                with st.spinner(get_localized_system_message("processing", st.session_state.language)):
-                    welcome_msg = get_localized_system_message("welcome", st.session_state.language)
-                    st.success(welcome_msg)
-                    st.chat_message("assistant").write(welcome_msg)
-                    st.session_state.chat_history.append({"role": "assistant", "content": welcome_msg})
+                st.success(welcome_msg)
+                st.chat_message("assistant").write(welcome_msg)
+                st.session_state.chat_history.append({"role": "assistant", "content": welcome_msg})
                 return
 
         if st.session_state.information_phase_complete and st.session_state.user_info:
             print(f"✅ USING EXISTING USER INFO: {st.session_state.user_info}")
-            # Q&A phase
-            with st.spinner(get_localized_system_message("thinking", st.session_state.language)):
-                response = call_chat_api(prompt)
-                if "error" in response:
-                    st.error(response["error"])
-                    return
-                st.chat_message("assistant").write(response["response"])
-                st.session_state.chat_history.append({"role": "assistant", "content": response["response"]})
+            # Q&A phase: render the answer while it streams in
+            try:
+                answer = st.chat_message("assistant").write_stream(stream_chat_api(prompt))
+            except Exception as e:
+                st.error(str(e))
+                return
+            st.session_state.chat_history.append({"role": "assistant", "content": answer})
             return
 
         if len(st.session_state.chat_history) >= 3 and prompt.lower() in ["yes", "correct", "right", "כן", "נכון"]:
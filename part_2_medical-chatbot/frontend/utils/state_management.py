@@ -5,6 +5,7 @@ from typing import Dict, Any
 def save_chat_state() -> str: # returns a json of all info
     state_data = {
         "chat_history": st.session_state.chat_history,
+        "history_summary": st.session_state.history_summary,
         "user_info": st.session_state.user_info,
         "language": st.session_state.language,
         "information_phase_complete": st.session_state.information_phase_complete
@@ -24,6 +25,7 @@ def load_chat_state(state_json: str) -> None: # loads a json of all info
         
         if "chat_history" in state_data:
             st.session_state.chat_history = state_data["chat_history"]
+            st.session_state.history_summary = state_data.get("history_summary", {"summary": "", "summary_upto": 0})
         if "user_info" in state_data:
             st.session_state.user_info = state_data["user_info"]
         if "language" in state_data:
@@ -35,6 +37,7 @@ def load_chat_state(state_json: str) -> None: # loads a json of all info
 
 def reset_chat_state() -> None:
     st.session_state.chat_history = []
+    st.session_state.history_summary = {"summary": "", "summary_upto": 0}
     st.session_state.user_info = None
     st.session_state.information_phase_complete = False
 